@@ -0,0 +1,191 @@
+"""JSON API for damage analysis, cost estimates, document checks and chat.
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Photo and PDF work runs in a per-server process pool (API_CPU_WORKERS), so
+the event loop stays free for other requests; add uvicorn workers to scale
+out. Chat answers can be streamed as NDJSON. Request counts and latencies
+are served in Prometheus text format at /metrics (per uvicorn worker).
+
+    curl -F images=@front.jpg -F claim_type=Vehicle -F scenario="minor dent" localhost:8000/v1/damage
+    curl -F pdf=@bill.pdf -F scenario="hospital stay" localhost:8000/v1/documents
+    curl -d '{"question": "What documents do I need?", "stream": true}' localhost:8000/v1/chat
+"""
+import asyncio
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import insurance_claim_assistant as app_core
+
+API_CPU_WORKERS = int(os.getenv("API_CPU_WORKERS", str(os.cpu_count() or 1)))
+API_MAX_UPLOAD_MB = int(os.getenv("API_MAX_UPLOAD_MB", "20"))
+API_MAX_IMAGES = int(os.getenv("API_MAX_IMAGES", "10"))
+
+class BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+async def read_uploads(form, field):
+    files = []
+    for upload in form.getlist(field):
+        if not hasattr(upload, "read"):
+            raise BadRequest(f"'{field}' must be a file upload")
+        data = await upload.read()
+        if len(data) > API_MAX_UPLOAD_MB * 2 ** 20:
+            raise BadRequest(f"{upload.filename} is larger than {API_MAX_UPLOAD_MB}MB", 413)
+        files.append(data)
+    return files
+
+def claim_fields(fields):
+    claim_type = fields.get("claim_type", "Vehicle")
+    claim_types = app_core.get_tariff().claim_types
+    if claim_type not in claim_types:
+        raise BadRequest(f"claim_type must be one of {', '.join(claim_types)}")
+    lang = fields.get("lang", "en")
+    if lang not in app_core.LANGUAGES:
+        raise BadRequest(f"lang must be one of {', '.join(app_core.LANGUAGES)}")
+    return claim_type, fields.get("scenario", ""), lang
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise BadRequest("body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("body must be a JSON object")
+    return body
+
+# assess_claim runs with workers=1 in the pool, so it never starts threads or a nested pool
+async def run_cpu(request, *args):
+    loop = asyncio.get_running_loop()
+    metrics = app_core.get_metrics()
+    with metrics.span("api_cpu", path=request.url.path):
+        result = await loop.run_in_executor(request.app.state.cpu_pool, app_core.assess_claim, *args)
+    # Image, PDF and translation stages were recorded in the worker process
+    metrics.merge(result.pop("metrics"))
+    return result
+
+def api(handler):
+    async def endpoint(request):
+        metrics = app_core.get_metrics()
+        start = time.perf_counter()
+        try:
+            response = await handler(request)
+        except BadRequest as e:
+            response = JSONResponse({"error": str(e)}, status_code=e.status)
+        except Exception as e:
+            app_core.log_event("api_error", f"API error in {request.url.path}: {e}", path=request.url.path, error=str(e))
+            response = JSONResponse({"error": "internal error"}, status_code=500)
+        # Streamed chat is timed to its headers; token timings are in llm_ttft_seconds
+        metrics.inc("api_requests_total", path=request.url.path, status=response.status_code)
+        metrics.observe("api_request_seconds", time.perf_counter() - start, path=request.url.path)
+        return response
+    return endpoint
+
+async def health(request):
+    return JSONResponse({"status": "ok", "cpu_workers": API_CPU_WORKERS})
+
+async def metrics(request):
+    if request.query_params.get("format") == "json":
+        return JSONResponse(app_core.get_metrics().snapshot())
+    return PlainTextResponse(app_core.get_metrics().prometheus(), media_type="text/plain; version=0.0.4")
+
+async def damage(request):
+    form = await request.form()
+    claim_type, scenario, lang = claim_fields(form)
+    images = await read_uploads(form, "images")
+    if not images:
+        raise BadRequest("upload at least one file in 'images'")
+    if len(images) > API_MAX_IMAGES:
+        raise BadRequest(f"at most {API_MAX_IMAGES} images per request")
+    # One photo per pool task, so a multi-photo claim spreads over the workers
+    results = await asyncio.gather(*(run_cpu(request, claim_type, scenario, [data], None, lang, 1) for data in images))
+    photos = [result["photos"][0] for result in results]
+    combined = app_core.combine_analyses(photos)
+    return JSONResponse({
+        "photos": photos,
+        "damage": {k: combined[k] for k in ("damage_level", "cost_multiplier")},
+        "estimate": list(app_core.estimate_repair_cost(scenario, combined, claim_type))
+    })
+
+async def estimate(request):
+    body = await read_json(request)
+    claim_type, scenario, _ = claim_fields(body)
+    levels = dict(app_core.DAMAGE_LEVELS)
+    level = body.get("damage_level", "moderate")
+    if level not in levels:
+        raise BadRequest(f"damage_level must be one of {', '.join(levels)}")
+    try:
+        multiplier = float(body.get("cost_multiplier", levels[level]))
+    except (TypeError, ValueError):
+        raise BadRequest("cost_multiplier must be a number")
+    if not math.isfinite(multiplier) or multiplier < 0:
+        raise BadRequest("cost_multiplier must be a finite, non-negative number")
+    analysis = {"damage_level": level, "cost_multiplier": multiplier}
+    return JSONResponse({"estimate": list(app_core.estimate_repair_cost(scenario, analysis, claim_type))})
+
+async def documents(request):
+    form = await request.form()
+    claim_type, scenario, lang = claim_fields(form)
+    pdfs = await read_uploads(form, "pdf")
+    if len(pdfs) != 1:
+        raise BadRequest("upload exactly one file in 'pdf'")
+    result = await run_cpu(request, claim_type, scenario, (), pdfs[0], lang, 1)
+    if result["document"]["error"]:
+        raise BadRequest(f"'pdf' could not be read as a PDF: {result['document']['error']}", 422)
+    return JSONResponse(result["document"])
+
+async def chat(request):
+    body = await read_json(request)
+    claim_type, scenario, lang = claim_fields(body)
+    question = body.get("question")
+    if not question:
+        raise BadRequest("'question' is required")
+    provider = body.get("provider", "groq")
+    if provider not in app_core.LLM_PROVIDERS:
+        raise BadRequest(f"provider must be one of {', '.join(app_core.LLM_PROVIDERS)}")
+    context = body.get("context") or f"{claim_type} claim scenario: {scenario}"
+
+    if not body.get("stream"):
+        answer = await run_in_threadpool(app_core.query_llm, question, provider, lang, claim_type, context)
+        return JSONResponse({"answer": answer})
+
+    def lines():
+        timings = {}
+        for token in app_core.stream_llm(question, provider, lang, claim_type, context, timings):
+            yield json.dumps({"token": token}, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "timings": timings}) + "\n"
+    # Sync generator: Starlette iterates it on the thread pool
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@contextlib.asynccontextmanager
+async def lifespan(server):
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    server.state.cpu_pool = ProcessPoolExecutor(max(1, API_CPU_WORKERS), mp_context=context)
+    # Fork the workers now, before the thread pool serving requests starts
+    server.state.cpu_pool.submit(os.getpid).result()
+    try:
+        yield
+    finally:
+        server.state.cpu_pool.shutdown(cancel_futures=True)
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/metrics", metrics),
+    Route("/v1/damage", api(damage), methods=["POST"]),
+    Route("/v1/estimate", api(estimate), methods=["POST"]),
+    Route("/v1/documents", api(documents), methods=["POST"]),
+    Route("/v1/chat", api(chat), methods=["POST"]),
+], lifespan=lifespan)
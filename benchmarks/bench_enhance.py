@@ -0,0 +1,63 @@
+"""Benchmark enhance_image: full-resolution baseline vs the fast path.
+
+    python benchmarks/bench_enhance.py
+    python benchmarks/bench_enhance.py --sizes 2 12 --denoisers nlm fast bilateral --repeat 3
+
+For every synthetic photo size it times today's behaviour (full resolution,
+NLM denoiser, single thread) against each denoiser tier at the configured
+working resolution and thread count. PSNR is measured against the NLM
+(original quality) output at the same working resolution, so it shows what
+each cheaper denoiser tier costs visually.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from fixtures import synthetic_photo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import insurance_claim_assistant as app
+
+def timed(fn, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.3, 2, 12], help="megapixels")
+    parser.add_argument("--denoisers", nargs="+", default=list(app.DENOISERS))
+    parser.add_argument("--max-side", type=int, default=app.ENHANCE_MAX_SIDE)
+    parser.add_argument("--workers", type=int, default=app.ENHANCE_WORKERS)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"working resolution {args.max_side}px, {args.workers} workers, {os.cpu_count()} CPUs")
+    print(f"{'size':>7} {'variant':>22} {'seconds':>9} {'speedup':>8} {'PSNR dB':>8}")
+    for mp in args.sizes:
+        photo = synthetic_photo(mp)
+        base_time, _ = timed(lambda: app.enhance_image(photo, max_side=0, denoiser="nlm", workers=1), args.repeat)
+        print(f"{mp:>5.1f}MP {'baseline (full-res nlm)':>22} {base_time:>9.3f} {'1.0x':>8} {'-':>8}")
+
+        reference = None
+        for denoiser in args.denoisers:
+            seconds, result = timed(lambda: app.enhance_image(photo, max_side=args.max_side, denoiser=denoiser,
+                                                              workers=args.workers), args.repeat)
+            result = np.array(result)
+            if reference is None:
+                reference = result if denoiser == "nlm" else np.array(
+                    app.enhance_image(photo, max_side=args.max_side, denoiser="nlm", workers=args.workers))
+            print(f"{mp:>5.1f}MP {denoiser:>22} {seconds:>9.3f} {base_time / seconds:>7.1f}x {psnr(result, reference):>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Generated fixtures for the benchmarks: damage photos and hospital-bill PDFs.
+
+Photos are gradients with random shapes, crack-like lines and sensor noise,
+so the denoiser and edge detector have realistic work to do. PDF pages are
+bill line items mixed with the phrases the document rules flag. Everything
+is drawn from a seeded generator, so the same size always gives the same
+bytes.
+"""
+import cv2
+import fitz
+import numpy as np
+from PIL import Image
+
+PHOTO_SIZES = (0.3, 2, 12, 48)  # megapixels
+PDF_PAGES = (1, 20, 100, 500)
+
+BILL_ITEMS = ["Room rent", "Nursing charges", "Pharmacy", "Consumables", "Pathology", "Radiology",
+              "Surgeon fee", "Anaesthesia", "OT charges", "Doctor visit", "ICU charges", "Physiotherapy"]
+BILL_REMARKS = ["paid in cash", "duplicate copy", "stamp missing", "policy expired", "entry overwritten",
+                "estimate only", "discharge summary attached", "pre-authorization approved"]
+
+def synthetic_photo(megapixels, seed=0):
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    w = int(h * 4 / 3)
+    # Built in row bands so a 48MP photo never needs an int or float copy of the whole frame
+    img = np.empty((h, w, 3), np.uint8)
+    x = np.arange(w)[None, :]
+    for top in range(0, h, 512):
+        y = np.arange(top, min(top + 512, h))[:, None]
+        img[top:top + 512, :, 0] = x * 255 // w
+        img[top:top + 512, :, 1] = y * 255 // h
+        img[top:top + 512, :, 2] = (x + y) * 255 // (w + h)
+    for _ in range(40):
+        cx, cy, r = int(rng.integers(w)), int(rng.integers(h)), int(rng.integers(h // 40 + 1, h // 6 + 2))
+        cv2.circle(img, (cx, cy), r, tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        cv2.line(img, (cx, cy), (int(rng.integers(w)), int(rng.integers(h))), (20, 20, 20), max(1, h // 300))
+    for top in range(0, h, 512):
+        band = img[top:top + 512]
+        band[:] = np.clip(band + rng.normal(0, 12, band.shape).astype(np.float32), 0, 255)
+    return Image.fromarray(img)
+
+def synthetic_pdf(pages, seed=0, lines=30):
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        rows = [f"City Hospital - Final Bill - Page {number} of {pages}", ""]
+        for _ in range(lines):
+            item = BILL_ITEMS[int(rng.integers(len(BILL_ITEMS)))]
+            row = f"{int(rng.integers(1, 29)):02d}/03/2024  {item:<18} Rs {int(rng.integers(200, 40000)):>7}"
+            if rng.random() < 0.05:
+                row += f"  ({BILL_REMARKS[int(rng.integers(len(BILL_REMARKS)))]})"
+            rows.append(row)
+        doc.new_page().insert_text((54, 60), "\n".join(rows), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -0,0 +1,159 @@
+"""Load test for api_server.py.
+
+    uvicorn api_server:app --port 8000 --workers 4
+    python benchmarks/load_api.py --endpoint damage --concurrency 16 --requests 400
+    python benchmarks/load_api.py --endpoint chat --stream --concurrency 32 --duration 60
+
+Sends requests from --concurrency threads (one keep-alive session each) and
+reports throughput, error counts and latency percentiles. For streamed chat
+the time to first token is reported as well. Photos and PDFs are synthetic
+unless --image/--pdf point at real files.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import fitz
+import numpy as np
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from insurance_claim_assistant import percentile
+
+QUESTIONS = [
+    "What documents do I need for my claim?",
+    "How long does the claim settlement take?",
+    "What should I do next for my insurance claim?",
+]
+
+def synthetic_jpeg(seed=0, size=(900, 1200)):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 255, (*size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def synthetic_pdf(pages=20):
+    doc = fitz.open()
+    for number in range(pages):
+        doc.new_page().insert_text((72, 72), f"Hospital bill page {number}: room rent, pharmacy, paid in cash")
+    return doc.tobytes()
+
+def load_file(path, fallback):
+    if not path:
+        return fallback()
+    with open(path, "rb") as f:
+        return f.read()
+
+def make_request(session, args, payloads, number):
+    url = f"{args.url}/v1/{args.endpoint}"
+    if args.endpoint == "damage":
+        # Distinct photos unless --repeat-payload, so the server's caches don't answer
+        image = payloads["image"] if args.repeat_payload else payloads["image"] + number.to_bytes(4, "big")
+        files = {"images": ("photo.jpg", image, "image/jpeg")}
+        return session.post(url, files=files, data={"claim_type": "Vehicle", "scenario": "minor dent"}, timeout=args.timeout), None
+    if args.endpoint == "documents":
+        files = {"pdf": ("bill.pdf", payloads["pdf"], "application/pdf")}
+        return session.post(url, files=files, data={"claim_type": "Health", "scenario": "hospital stay"}, timeout=args.timeout), None
+    if args.endpoint == "estimate":
+        body = {"claim_type": "Home", "damage_level": ["minimal", "minor", "moderate", "severe"][number % 4]}
+        return session.post(url, json=body, timeout=args.timeout), None
+    body = {"question": QUESTIONS[number % len(QUESTIONS)], "provider": args.provider, "stream": args.stream}
+    if not args.stream:
+        return session.post(url, json=body, timeout=args.timeout), None
+    start = time.perf_counter()
+    ttft = None
+    with session.post(url, json=body, timeout=args.timeout, stream=True) as response:
+        for line in response.iter_lines(chunk_size=None):
+            if ttft is None and line:
+                ttft = time.perf_counter() - start
+    return response, ttft
+
+def worker(args, payloads, counter, lock, results, stop_at):
+    session = requests.Session()
+    while time.perf_counter() < stop_at:
+        with lock:
+            if args.requests and counter[0] >= args.requests:
+                return
+            number = counter[0]
+            counter[0] += 1
+        start = time.perf_counter()
+        try:
+            response, ttft = make_request(session, args, payloads, number)
+            ok = response.status_code == 200
+            status = response.status_code
+        except requests.RequestException as e:
+            ok, status, ttft = False, type(e).__name__, None
+        with lock:
+            results.append((ok, status, time.perf_counter() - start, ttft))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="damage", choices=["damage", "documents", "estimate", "chat"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="total requests (0 = run for --duration)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds before stopping")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--provider", default="groq")
+    parser.add_argument("--stream", action="store_true", help="stream chat answers")
+    parser.add_argument("--repeat-payload", action="store_true", help="send the same photo every time (cache hits)")
+    parser.add_argument("--image", help="JPEG to upload instead of a synthetic photo")
+    parser.add_argument("--pdf", help="PDF to upload instead of a synthetic bill")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    payloads = {
+        "image": load_file(args.image, synthetic_jpeg) if args.endpoint == "damage" else None,
+        "pdf": load_file(args.pdf, synthetic_pdf) if args.endpoint == "documents" else None,
+    }
+    counter, lock, results = [0], threading.Lock(), []
+    started = time.perf_counter()
+    stop_at = started + args.duration
+    threads = [threading.Thread(target=worker, args=(args, payloads, counter, lock, results, stop_at))
+               for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for ok, _, latency, _ in results if ok]
+    ttfts = [ttft for ok, _, _, ttft in results if ok and ttft is not None]
+    errors = {}
+    for ok, status, _, _ in results:
+        if not ok:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    summary = {
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "requests": len(results),
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+    }
+    for pct in (50, 95, 99):
+        if latencies:
+            summary[f"p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 1)
+        if ttfts:
+            summary[f"ttft_p{pct}_ms"] = round(percentile(ttfts, pct) * 1000, 1)
+
+    print(f"{args.endpoint}: {summary['ok']}/{summary['requests']} ok in {summary['seconds']}s, "
+          f"{summary['throughput_rps']} req/s")
+    for key, value in summary.items():
+        if key.endswith("_ms"):
+            print(f"  {key:<14} {value}")
+    if errors:
+        print(f"  errors         {errors}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Benchmark the image, PDF, cost and LLM hot paths and compare with a baseline.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --quick --only enhance_image analyze_image
+    python benchmarks/run_benchmarks.py --update-baseline
+
+Cases run on generated fixtures (photos 0.3-48MP, PDFs 1-500 pages, see
+fixtures.py; --quick keeps the two smallest of each). Every case makes one
+untimed warm-up call, then reports its best wall time over --repeat runs,
+throughput and peak resident memory above the level before the case, worker
+processes included (Linux only). query_llm runs against the stub
+server in stub_llm.py, with unique prompts so the answer cache never hits.
+
+Results are written as JSON and compared with baseline.json. A case is a
+regression when it is slower or uses more memory than its baseline by more
+than the thresholds stored there (a "default" entry, overridden per
+benchmark name); the script then exits with status 1.
+Baselines are machine specific, so refresh them with --update-baseline on
+the machine that runs the comparison.
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fixtures import PDF_PAGES, PHOTO_SIZES, synthetic_pdf, synthetic_photo
+from stub_llm import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = ("enhance_image", "analyze_image", "estimate_repair_cost", "generate_report", "query_llm")
+DEFAULT_THRESHOLDS = {
+    "seconds": 0.25,      # fraction slower than the baseline
+    "peak_mb": 0.25,      # fraction more memory than the baseline
+    "min_seconds": 0.02,  # differences below these are noise
+    "min_mb": 16
+}
+SCENARIOS = ["Minor dent on the rear bumper", "Severe flood damage to the kitchen", "Hospital stay for surgery",
+             "Moderate scratches after a parking accident", "Theft of electronics", "Water leak in the ceiling"]
+
+# Peak RSS is reset through clear_refs, so each case is measured on its own (Linux >= 4.0)
+def reset_peak_rss(pid="self"):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def rss_mb(field, pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:  # the process has exited
+        return None
+
+# The app's process pool (large PDFs, photos) forks workers whose memory /proc/self does not include
+def child_pids():
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so fields are counted after its closing parenthesis
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == os.getpid():
+                    pids.append(entry)
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+def measure(fn, repeat, before=None):
+    # Untimed warm-up: first-call costs (lazy imports, caches, pool start-up) would otherwise be timed
+    if before:
+        before()
+    fn()
+    gc.collect()
+    tracked = reset_peak_rss()
+    start_rss = rss_mb("VmRSS") if tracked else None
+    workers = {pid: rss_mb("VmRSS", pid) if reset_peak_rss(pid) else None for pid in child_pids()}
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    if not tracked:
+        return best, None, result
+    # Worker peaks are added up, so this is an upper bound when they did not peak together
+    peak = max(0.0, rss_mb("VmHWM") - start_rss)
+    for pid in child_pids():
+        hwm = rss_mb("VmHWM", pid)
+        if hwm is not None:
+            peak += max(0.0, hwm - (workers.get(pid) or 0.0))
+    return best, round(peak, 1), result
+
+def case(seconds, amount, unit, peak, **extra):
+    return {"seconds": round(seconds, 4), "throughput": round(amount / seconds, 2) if seconds else None,
+            "unit": unit, "peak_mb": peak, **extra}
+
+def bench_images(app, args, name):
+    results = {}
+    for mp in args.photo_sizes:
+        photo = synthetic_photo(mp)
+        if name == "enhance_image":
+            seconds, peak, _ = measure(lambda: app.enhance_image(photo), args.repeat)
+        else:
+            pixels = np.asarray(photo)
+            seconds, peak, _ = measure(lambda: app.analyze_image(pixels), args.repeat)
+            del pixels
+        results[f"{name}[{mp:g}MP]"] = case(seconds, mp, "MP/s", peak)
+        del photo
+    return results
+
+def bench_estimates(app, args):
+    levels = list(dict(app.DAMAGE_LEVELS).items())
+    claims = [(SCENARIOS[i % len(SCENARIOS)], {"damage_level": levels[i % len(levels)][0],
+                                               "cost_multiplier": levels[i % len(levels)][1]},
+               ("Vehicle", "Home", "Health")[i % 3]) for i in range(args.claims)]
+    seconds, peak, _ = measure(lambda: [app.estimate_repair_cost(*claim) for claim in claims], args.repeat)
+    return {f"estimate_repair_cost[{args.claims}]": case(seconds, args.claims, "claims/s", peak)}
+
+def bench_reports(app, args):
+    results = {}
+    cache = app.get_document_cache()
+    for pages in args.pdf_pages:
+        pdf = synthetic_pdf(pages)
+        agent = app.HealthAgent("en")
+        # Cold runs: the document cache would otherwise answer every repeat after the first
+        seconds, peak, _ = measure(lambda: agent.generate_report(pdf, "Hospital stay for surgery"), args.repeat,
+                                   before=cache.clear)
+        results[f"generate_report[{pages}p]"] = case(seconds, pages, "pages/s", peak, flags=len(agent.hits))
+    return results
+
+def bench_llm(app, args):
+    results = {}
+    prompts = (f"What documents do I need for claim #{n}?" for n in itertools.count())
+    for concurrency in args.llm_concurrency:
+        latencies = []
+        def ask(prompt):
+            start = time.perf_counter()
+            answer = app.query_llm(prompt, "ollama", "en", "Vehicle", "Vehicle claim scenario: minor dent")
+            latencies.append(time.perf_counter() - start)
+            return answer
+        def batch():
+            with ThreadPoolExecutor(concurrency) as pool:
+                return list(pool.map(ask, [next(prompts) for _ in range(args.llm_requests)]))
+        seconds, peak, answers = measure(batch, args.repeat)
+        fallbacks = sum(answer == app.default_response("Vehicle", "en") for answer in answers)
+        results[f"query_llm[c{concurrency}]"] = case(
+            seconds, args.llm_requests, "requests/s", peak, fallbacks=fallbacks,
+            p50_ms=round(app.percentile(latencies, 50) * 1000, 1), p95_ms=round(app.percentile(latencies, 95) * 1000, 1))
+    return results
+
+def machine():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "commit": commit, "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+
+def compare(results, baseline):
+    thresholds = baseline.get("thresholds", {})
+    rows, regressions = [], []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            rows.append((name, result, None, "new"))
+            continue
+        limit = {**DEFAULT_THRESHOLDS, **thresholds.get("default", {}), **thresholds.get(name.split("[")[0], {})}
+        slower = (result["seconds"] > base["seconds"] * (1 + limit["seconds"])
+                  and result["seconds"] - base["seconds"] > limit["min_seconds"])
+        heavier = (result["peak_mb"] is not None and base.get("peak_mb") is not None
+                   and result["peak_mb"] > base["peak_mb"] * (1 + limit["peak_mb"])
+                   and result["peak_mb"] - base["peak_mb"] > limit["min_mb"])
+        status = " + ".join(s for s, bad in (("SLOWER", slower), ("MORE MEMORY", heavier)) if bad) or "ok"
+        if slower or heavier:
+            regressions.append(name)
+        rows.append((name, result, base, status))
+    return rows, regressions
+
+def print_rows(rows):
+    print(f"\n{'case':<30} {'seconds':>9} {'baseline':>9} {'change':>8} {'throughput':>18} {'peak MB':>8}  status")
+    for name, result, base, status in rows:
+        change = f"{(result['seconds'] / base['seconds'] - 1) * 100:+.0f}%" if base and base["seconds"] else "-"
+        throughput = f"{result['throughput']} {result['unit']}" if result["throughput"] is not None else "-"
+        peak = "-" if result["peak_mb"] is None else result["peak_mb"]
+        print(f"{name:<30} {result['seconds']:>9.4f} {base['seconds'] if base else '-':>9} {change:>8} "
+              f"{throughput:>18} {peak:>8}  {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smallest photos and PDFs only")
+    parser.add_argument("--photo-sizes", type=float, nargs="+", help="megapixels")
+    parser.add_argument("--pdf-pages", type=int, nargs="+")
+    parser.add_argument("--claims", type=int, default=5000, help="estimate_repair_cost calls per run")
+    parser.add_argument("--llm-requests", type=int, default=40, help="query_llm calls per run")
+    parser.add_argument("--llm-concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="stub server seconds per answer")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=os.path.join(ROOT, ".cache", "benchmarks", "results.json"))
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log output")
+    args = parser.parse_args()
+    args.photo_sizes = args.photo_sizes or (PHOTO_SIZES[:2] if args.quick else PHOTO_SIZES)
+    args.pdf_pages = args.pdf_pages or (PDF_PAGES[:2] if args.quick else PDF_PAGES)
+
+    # The app reads its configuration at import: point Ollama at the stub and keep
+    # every cache in memory so runs neither read nor fill the real ones
+    stub, url = start_stub(latency=args.llm_latency)
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({"OLLAMA_API_URL": url, "LLM_FALLBACK_ORDER": "ollama", "DOCUMENT_CACHE_PATH": "",
+                       "TRANSLATION_CACHE_PATH": os.path.join(scratch, "translations.sqlite3")})
+    os.environ.pop("LLM_CACHE_PATH", None)
+    sys.path.insert(0, ROOT)
+    try:
+        import insurance_claim_assistant as app
+
+        print(f"{os.cpu_count()} CPUs, enhance at {app.ENHANCE_MAX_SIDE}px with {app.ENHANCE_WORKERS} workers, "
+              f"{args.repeat} runs per case")
+        results = {}
+        for name in args.only:
+            started = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                if name in ("enhance_image", "analyze_image"):
+                    results.update(bench_images(app, args, name))
+                elif name == "estimate_repair_cost":
+                    results.update(bench_estimates(app, args))
+                elif name == "generate_report":
+                    results.update(bench_reports(app, args))
+                else:
+                    results.update(bench_llm(app, args))
+            print(f"{name} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {"meta": machine(), "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    rows, regressions = compare(results, baseline)
+    print_rows(rows)
+    print(f"\nResults written to {args.output}")
+    if baseline.get("meta", {}).get("cpus") not in (None, os.cpu_count()):
+        print(f"Baseline was recorded on {baseline['meta']['cpus']} CPUs; timings may not be comparable")
+
+    if args.update_baseline:
+        baseline.setdefault("thresholds", {"default": DEFAULT_THRESHOLDS})
+        baseline["meta"] = report["meta"]
+        baseline["results"] = {**baseline.get("results", {}), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
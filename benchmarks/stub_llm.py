@@ -0,0 +1,92 @@
+"""Ollama-compatible stub LLM server for benchmarks and offline runs.
+
+    python benchmarks/stub_llm.py --port 11500 --latency 0.2 --tokens 120
+    OLLAMA_API_URL=http://localhost:11500 streamlit run insurance_claim_assistant.py
+
+Serves /api/tags (the health check) and /api/generate, plain or streamed.
+Each answer starts after --latency seconds and streamed tokens are
+--token-delay apart. Answers are fixed text, so every run does the same
+work and timings reflect the client side only.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = ("Please keep the claim form, policy copy, photos of the damage and all original bills ready. "
+                "Inform your insurer within the deadline and ask for a claim reference number.").split()
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": "phi3"}]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != "/api/generate":
+            self.send_json({"error": "not found"}, 404)
+            return
+        settings = self.server.settings
+        words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(settings["tokens"])]
+        time.sleep(settings["latency"])
+        if not body.get("stream"):
+            self.send_json({"model": body.get("model"), "response": " ".join(words), "done": True})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i and settings["token_delay"]:
+                time.sleep(settings["token_delay"])
+            self.send_chunk(json.dumps({"response": (" " if i else "") + word, "done": False}).encode() + b"\n")
+        self.send_chunk(json.dumps({"response": "", "done": True}).encode() + b"\n")
+        self.send_chunk(b"")
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub(host="127.0.0.1", port=0, latency=0.05, tokens=80, token_delay=0.0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.settings = {"latency": latency, "tokens": tokens, "token_delay": token_delay}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=80, help="words per answer")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+    server, url = start_stub(args.host, args.port, args.latency, args.tokens, args.token_delay)
+    print(f"Stub LLM listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
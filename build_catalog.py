@@ -0,0 +1,74 @@
+"""Build the precompiled translation catalogs in locales/.
+
+Extracts every static string the UI passes to the translator, fills in the
+ones missing from locales/<lang>.json (machine translation, review the diff)
+and compiles each language to locales/<lang>.cat for the app to memory-map.
+
+    python build_catalog.py                # all languages that have a .json
+    python build_catalog.py --lang hi --offline
+"""
+import argparse
+import ast
+import json
+import os
+
+import insurance_claim_assistant as app
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insurance_claim_assistant.py")
+
+def extract_static_strings(source_path=SOURCE):
+    with open(source_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    strings = []
+    for node in ast.walk(tree):
+        # translator.translate("literal", ...) calls
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr == "translate" and node.args
+                and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            strings.append(node.args[0].value)
+        # UI_STRINGS = [...]
+        elif (isinstance(node, ast.Assign) and isinstance(node.value, ast.List)
+                and any(isinstance(t, ast.Name) and t.id == "UI_STRINGS" for t in node.targets)):
+            strings.extend(e.value for e in node.value.elts if isinstance(e, ast.Constant))
+    return list(dict.fromkeys(strings))
+
+def build(lang, strings, offline=False):
+    json_path = os.path.join(app.CATALOG_DIR, f"{lang}.json")
+    entries = {}
+    if os.path.exists(json_path):
+        with open(json_path, encoding="utf-8") as f:
+            entries = json.load(f)
+
+    # English default responses only need a catalog entry where no hand-written version exists
+    wanted = strings + [r["en"] for r in app.DEFAULT_RESPONSES.values() if lang not in r]
+    missing = [s for s in wanted if s not in entries]
+    if missing and not offline:
+        print(f"[{lang}] translating {len(missing)} new strings")
+        # Go straight to the network - the loaded catalog must not answer for itself
+        live = app.InsuranceTranslator(app.LRUCache(len(missing) + 1))
+        entries.update(zip(missing, live.translate_many(missing, lang)))
+    elif missing:
+        print(f"[{lang}] {len(missing)} strings have no translation yet (offline build)")
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(entries.items())), f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+    count = app.compile_catalog(entries, os.path.join(app.CATALOG_DIR, f"{lang}.cat"))
+    print(f"[{lang}] compiled {count} entries")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lang", action="append", help="language code to build (repeatable)")
+    parser.add_argument("--offline", action="store_true", help="compile existing translations without calling the translator")
+    args = parser.parse_args()
+
+    langs = args.lang or sorted(n[:-5] for n in os.listdir(app.CATALOG_DIR) if n.endswith(".json"))
+    strings = extract_static_strings()
+    print(f"Found {len(strings)} static UI strings")
+    for lang in langs:
+        build(lang, strings, offline=args.offline)
+
+if __name__ == "__main__":
+    main()
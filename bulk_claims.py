@@ -0,0 +1,172 @@
+"""Triage a batch of claims without the Streamlit UI.
+
+Reads a JSONL manifest with one claim per line:
+
+    {"id": "C-1001", "type": "Vehicle", "scenario": "Rear-ended at a signal",
+     "images": ["photos/c1001_front.jpg"], "pdf": "docs/c1001.pdf"}
+
+Paths are relative to the manifest. Photos and documents are assessed in a
+process pool, then each claim's follow-up question goes to the LLM with
+bounded concurrency. Results are appended to the output JSONL as claims
+finish; claims already written with status "ok" are skipped on restart.
+
+    python bulk_claims.py claims.jsonl -o results.jsonl --workers 8 --llm-concurrency 4
+    python bulk_claims.py claims.jsonl -o results.jsonl --no-llm
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import insurance_claim_assistant as app
+
+def read_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            claim = json.loads(line)
+            claim.setdefault("id", f"line-{number}")
+            claim["images"] = [os.path.join(base, p) for p in claim.get("images") or ([claim["image"]] if claim.get("image") else [])]
+            claim["pdf"] = os.path.join(base, claim["pdf"]) if claim.get("pdf") else None
+            yield claim
+
+def finished_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # line cut short by an interrupted run
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# CPU stage, runs in a worker process: one claim at a time, single-threaded
+def assess(claim):
+    start = time.perf_counter()
+    images = [read_bytes(p) for p in claim["images"]]
+    pdf = read_bytes(claim["pdf"]) if claim["pdf"] else None
+    assessment = app.assess_claim(claim.get("type", "Vehicle"), claim.get("scenario", ""), images, pdf,
+                                  claim.get("lang", "en"), workers=1)
+    assessment.pop("metrics")
+    return assessment, time.perf_counter() - start
+
+# LLM stage, runs on the thread pool
+def ask(claim, assessment, provider):
+    start = time.perf_counter()
+    claim_type = claim.get("type", "Vehicle")
+    question = claim.get("question") or f"What should I do next for my {claim_type} insurance claim?"
+    answer = app.query_llm(question, provider, claim.get("lang", "en"), claim_type,
+                           app.claim_context(claim_type, claim.get("scenario", ""), assessment))
+    return answer, time.perf_counter() - start
+
+def summarize(latencies, label):
+    if not latencies:
+        return f"  {label:<6} -"
+    return (f"  {label:<6} p50 {app.percentile(latencies, 50):7.2f}s  p95 {app.percentile(latencies, 95):7.2f}s"
+            f"  max {max(latencies):7.2f}s")
+
+def run(args):
+    skip = finished_ids(args.output)
+    claims = (c for c in read_manifest(args.manifest) if c["id"] not in skip)
+    if skip:
+        print(f"Resuming: {len(skip)} claims already done")
+
+    methods = multiprocessing.get_all_start_methods()
+    cpu_pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("fork" if "fork" in methods else None))
+    # Fork the workers now, before the LLM threads start
+    cpu_pool.submit(os.getpid).result()
+    llm_pool = ThreadPoolExecutor(args.llm_concurrency, thread_name_prefix="llm")
+    pending = {}
+    latencies = {"cpu": [], "llm": [], "total": []}
+    counts = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+    exhausted = False
+    in_flight_limit = args.workers * 2 + (0 if args.no_llm else args.llm_concurrency * 2)
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            if record["status"] == "ok":
+                latencies["total"].append(record["seconds"])
+            done = counts["ok"] + counts["error"]
+            if done % args.progress_every == 0:
+                print(f"{done} claims, {done / (time.perf_counter() - started):.2f}/s", file=sys.stderr)
+
+        while pending or not exhausted:
+            # Keep the CPU pool fed without reading the whole manifest into memory. Claims
+            # waiting for the LLM count too, so a slow LLM stops the reading instead of
+            # piling up assessments
+            in_cpu = sum(1 for stage, _, _ in pending.values() if stage == "cpu")
+            while not exhausted and in_cpu < args.workers * 2 and len(pending) < in_flight_limit:
+                claim = next(claims, None)
+                if claim is None:
+                    exhausted = True
+                    break
+                pending[cpu_pool.submit(assess, claim)] = ("cpu", claim, time.perf_counter())
+                in_cpu += 1
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, claim, submitted = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    write({"id": claim["id"], "status": "error", "stage": stage, "error": str(e)})
+                    continue
+                if stage == "cpu":
+                    assessment, seconds = result
+                    latencies["cpu"].append(seconds)
+                    claim["assessment"] = assessment
+                    if args.no_llm:
+                        write({"id": claim["id"], "status": "ok", "seconds": round(time.perf_counter() - submitted, 3), **assessment})
+                    else:
+                        pending[llm_pool.submit(ask, claim, assessment, args.provider)] = ("llm", claim, submitted)
+                else:
+                    answer, seconds = result
+                    latencies["llm"].append(seconds)
+                    write({"id": claim["id"], "status": "ok", "seconds": round(time.perf_counter() - submitted, 3),
+                           **claim["assessment"], "answer": answer})
+
+    cpu_pool.shutdown()
+    llm_pool.shutdown()
+    elapsed = time.perf_counter() - started
+    processed = counts["ok"] + counts["error"]
+    print(f"\nProcessed {processed} claims in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.2f} claims/s)")
+    print(f"  ok {counts['ok']}, errors {counts['error']}, skipped {len(skip)}")
+    print(summarize(latencies["cpu"], "cpu"))
+    print(summarize(latencies["llm"], "llm"))
+    print(summarize(latencies["total"], "total"))
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="JSONL file with one claim per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for photo/document work")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM requests in flight at once")
+    parser.add_argument("--provider", default="groq", choices=sorted(app.LLM_PROVIDERS), help="preferred LLM provider")
+    parser.add_argument("--no-llm", action="store_true", help="only assess photos and documents")
+    parser.add_argument("--progress-every", type=int, default=50, help="print throughput every N claims")
+    args = parser.parse_args()
+    counts = run(args)
+    sys.exit(1 if counts["error"] and not counts["ok"] else 0)
+
+if __name__ == "__main__":
+    main()
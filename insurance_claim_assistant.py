@@ -1,17 +1,40 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import io
 import fitz  # PyMuPDF
 import streamlit as st
 from dotenv import load_dotenv
 from streamlit_chat import message
-from PIL import Image
+from PIL import Image, ImageOps
 import cv2
 import numpy as np
 from googletrans import Translator
 import time
 from datetime import datetime
 import json
+import bisect
+import contextlib
+import functools
+import hashlib
+import mmap
+import pickle
+import queue
+import random
+import re
+import sqlite3
+import struct
+import threading
+import weakref
+from collections import Counter, OrderedDict, deque
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+try:
+    import fcntl  # POSIX only - shared rate limits across processes
+except ImportError:
+    fcntl = None
 
 # Load API keys
 load_dotenv()
@@ -24,18 +47,135 @@ OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
 REQUEST_TIMEOUT = 60  # Increased timeout
 MAX_RETRIES = 3
 
+# Connection pooling for LLM providers - one keep-alive session per provider, shared by all sessions
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", str(REQUEST_TIMEOUT)))
+OLLAMA_HEALTH_TTL = 30  # seconds a successful /api/tags check is trusted
+
+# Failover - the selected provider is tried first, then the rest of this order
+LLM_FALLBACK_ORDER = [p.strip() for p in os.getenv("LLM_FALLBACK_ORDER", "groq,gemini,ollama,huggingface").split(",") if p.strip()]
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))  # seconds before giving up and using DEFAULT_RESPONSES
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_CAP = 8
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = 90
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "8"))  # used until a provider has latency history
+
+# Rate limiting - per-provider token buckets (rate_per_minute/burst in LLM_PROVIDERS) plus a
+# concurrency cap that halves on 429s/timeouts. Set a directory to share buckets between processes.
+LLM_RATE_LIMIT_DIR = os.getenv("LLM_RATE_LIMIT_DIR")
+
+# LLM answer cache - repeat questions (e.g. the Quick Actions) skip the provider entirely
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(6 * 3600)))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")  # set to persist answers in SQLite
+LLM_CACHE_FUZZY = os.getenv("LLM_CACHE_FUZZY", "0") == "1"  # ignore case/whitespace differences
+
+# Translation cache - shared by all sessions, persisted so restarts start warm
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join(".cache", "translations.sqlite3"))
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "5000"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSLATE_BATCH_CHARS = 4500  # Google Translate rejects requests over ~5000 characters
+TRANSLATE_WORKERS = 4
+
+# Image enhancement - photos are processed at a working resolution, with the denoiser
+# run tile by tile on a thread pool (OpenCV releases the GIL)
+ENHANCE_MAX_SIDE = int(os.getenv("ENHANCE_MAX_SIDE", "1600"))  # longest side in pixels, 0 = full resolution
+ENHANCE_DENOISER = os.getenv("ENHANCE_DENOISER", "nlm")  # nlm, fast, bilateral or none
+ENHANCE_WORKERS = int(os.getenv("ENHANCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+ENHANCE_TILE = 512
+ENHANCE_TILE_OVERLAP = 16  # covers the NLM search (21px) and template (7px) window radii
+
+# Processed photos are cached by content hash so reruns never redo the same image
+IMAGE_PIPELINE_VERSION = 3  # bump when enhancement/analysis output changes
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "256"))
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH")  # set to spill processed images to SQLite
+IMAGE_CACHE_DISK_MB = int(os.getenv("IMAGE_CACHE_DISK_MB", "2048"))
+
+# Multi-photo claims - photos are processed in parallel worker processes and their
+# damage is combined by taking the worst photo ("max") or a quality-weighted average
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+DAMAGE_COMBINE = os.getenv("DAMAGE_COMBINE", "max")
+
+# Localized damage analysis - the photo is split into DAMAGE_GRID tiles along its longer
+# side and severity comes from the strongest local maxima (0 = one global density)
+DAMAGE_GRID = int(os.getenv("DAMAGE_GRID", "8"))
+DAMAGE_TOP_K = int(os.getenv("DAMAGE_TOP_K", "3"))
+
+# Health document extraction - large PDFs are split into page ranges for the process pool,
+# and pathological documents are cut off after PDF_MAX_PAGES pages or PDF_TIMEOUT seconds
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_TIMEOUT = float(os.getenv("PDF_TIMEOUT", "60"))
+PDF_PARALLEL_PAGES = int(os.getenv("PDF_PARALLEL_PAGES", "40"))  # smaller PDFs are read in-process
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", "20"))
+PDF_SUMMARY_CHARS = 500
+
+# Analyzed documents (page text + rule hits) are cached by content hash, in memory and on disk
+DOCUMENT_CACHE_MB = int(os.getenv("DOCUMENT_CACHE_MB", "64"))
+DOCUMENT_CACHE_PATH = os.getenv("DOCUMENT_CACHE_PATH", os.path.join(".cache", "documents.sqlite3"))
+DOCUMENT_CACHE_DISK_MB = int(os.getenv("DOCUMENT_CACHE_DISK_MB", "1024"))
+
+# Chat retrieval over the uploaded document - pages are split into overlapping word
+# chunks and the best BM25 matches are added to the prompt within a token budget
+RETRIEVAL_CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "120"))
+RETRIEVAL_OVERLAP_WORDS = int(os.getenv("RETRIEVAL_OVERLAP_WORDS", "30"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_TOKENS = int(os.getenv("RETRIEVAL_TOKENS", "600"))
+
+# Chat memory - recent turns go into the prompt verbatim, older ones are folded into a
+# running summary, all within CHAT_MEMORY_TOKENS. The page shows CHAT_PAGE_TURNS at a time.
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", "800"))
+CHAT_KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "4"))
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "200"))  # older turns are dropped from the page
+CHAT_PAGE_TURNS = int(os.getenv("CHAT_PAGE_TURNS", "10"))
+
+# Background jobs - photo and PDF analysis run on a small worker pool so reruns (and other
+# users) are not blocked; the page polls job progress every JOB_POLL_SECONDS
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "900"))  # seconds finished jobs are kept
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Repair cost tariffs - base ranges per claim type and severity, with region and
+# vehicle/property class factors (falls back to CLAIM_TYPE_BASES if the file is missing)
+TARIFF_PATH = os.getenv("TARIFF_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariffs", "repair_tariffs.json"))
+
+# Metrics - stage timings, counters and per-provider latency histograms, shown in the debug
+# panel and exportable as Prometheus text. LOG_FORMAT=json turns log lines into JSON events.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Document issue rules (literals and regexes), compiled once into a single scanner
+DOCUMENT_RULES_PATH = os.getenv("DOCUMENT_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules", "document_rules.json"))
+
+# Precompiled UI translations, built with `python build_catalog.py`
+CATALOG_DIR = os.getenv("CATALOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+
 # LLM provider configs - Fixed URLs and endpoints
 LLM_PROVIDERS = {
     "huggingface": {
         "url": "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.1",
+        "model": "mistralai/Mistral-7B-Instruct-v0.1",
+        "rate_per_minute": 30,
+        "max_concurrency": 4,
         "headers": {"Authorization": f"Bearer {HF_TOKEN}"}
     },
     "gemini": {
         "url": f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={GEMINI_API_KEY}",
+        "stream_url": f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}",
+        "model": "gemini-pro",
+        "rate_per_minute": 60,
+        "max_concurrency": 8,
         "headers": {"Content-Type": "application/json"}
     },
     "groq": {
         "url": "https://api.groq.com/openai/v1/chat/completions",
+        "model": "mixtral-8x7b-32768",
+        "rate_per_minute": 30,
+        "max_concurrency": 8,
         "headers": {
             "Authorization": f"Bearer {GROQ_API_KEY}",
             "Content-Type": "application/json"
@@ -43,79 +183,784 @@ LLM_PROVIDERS = {
     },
     "ollama": {
         "url": f"{OLLAMA_API_URL}/api/generate",
-        "headers": {"Content-Type": "application/json"}
+        "model": "phi3",
+        "health_url": f"{OLLAMA_API_URL}/api/tags",
+        "headers": {"Content-Type": "application/json"},
+        "connect_timeout": 2,  # local server - fail fast when it is not running
+        "max_concurrency": 2
     }
 }
 
+# Pool workers are forked from multithreaded processes (the Streamlit server, uvicorn). A lock
+# another thread held at that moment would stay held in the child, so objects the workers use
+# get their locks re-created there.
+FORK_SAFE_LOCKS = weakref.WeakKeyDictionary()
+
+def fork_safe_lock(owner, factory=threading.Lock):
+    FORK_SAFE_LOCKS[owner] = factory
+    return factory()
+
+def reset_locks_after_fork():
+    for owner, factory in list(FORK_SAFE_LOCKS.items()):
+        owner.lock = factory()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_locks_after_fork)
+
+# Metrics
+def log_event(event, message=None, **fields):
+    if LOG_FORMAT == "json":
+        print(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str), flush=True)
+    elif message:
+        print(message)
+
+def metric_labels(labels):
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = fork_safe_lock(self)
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts, total, count = self.histograms.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.histograms[key] = (counts, total + seconds, count + 1)
+    
+    # What was recorded since an earlier state(), as plain lists so it can cross processes:
+    # a pool worker returns it with its result and the serving process merges it
+    def state(self):
+        with self.lock:
+            return dict(self.counters), {key: (list(counts), total, count)
+                                         for key, (counts, total, count) in self.histograms.items()}
+    
+    def since(self, state):
+        counters, histograms = state
+        with self.lock:
+            added = [[name, labels, value - counters.get((name, labels), 0)]
+                     for (name, labels), value in self.counters.items() if value != counters.get((name, labels), 0)]
+            observed = []
+            for key, (counts, total, count) in self.histograms.items():
+                old_counts, old_total, old_count = histograms.get(key) or ([0] * len(counts), 0.0, 0)
+                if count != old_count:
+                    observed.append([key[0], key[1], [a - b for a, b in zip(counts, old_counts)],
+                                     total - old_total, count - old_count])
+        return {"counters": added, "histograms": observed}
+    
+    def merge(self, delta):
+        with self.lock:
+            for name, labels, value in delta["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, counts, total, count in delta["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                old_counts, old_total, old_count = self.histograms.get(key) or ([0] * len(counts), 0.0, 0)
+                self.histograms[key] = ([a + b for a, b in zip(old_counts, counts)], old_total + total, old_count + count)
+    
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe("stage_seconds", seconds, stage=stage, **labels)
+            log_event("span", stage=stage, seconds=round(seconds, 4), outcome=outcome, **labels)
+    
+    # Upper bound of the bucket holding the quantile, as Prometheus' histogram_quantile would
+    def quantile(self, counts, count, q):
+        seen = 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+            seen += bucket
+            if seen >= q * count:
+                return bound if bound != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+    
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {
+            "counters": {name + metric_labels(labels): value for (name, labels), value in sorted(counters.items())},
+            "latency": {
+                name + metric_labels(labels): {
+                    "count": count,
+                    "mean_s": round(total / count, 4),
+                    "p50_s": self.quantile(counts, count, 0.5),
+                    "p95_s": self.quantile(counts, count, 0.95)
+                } for (name, labels), (counts, total, count) in sorted(histograms.items())
+            }
+        }
+    
+    def prometheus(self, prefix="insurancesaathi_", gauges=None):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                typed.add(name)
+            lines.append(f"{prefix}{name}{metric_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{prefix}{name}_bucket{metric_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{metric_labels(labels)} {total}")
+            lines.append(f"{prefix}{name}_count{metric_labels(labels)} {count}")
+        for (name, labels), value in sorted((gauges or {}).items()):
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} gauge")
+                typed.add(name)
+            lines.append(f"{prefix}{name}{metric_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+# Bounded LRU cache with TTL and optional SQLite write-through
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=None, path=None, table="cache", disk_max_entries=None,
+                 max_bytes=None, sizeof=None, disk_max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.table = table
+        self.disk_max_entries = disk_max_entries or max_entries * 10
+        # Byte limits only apply when `sizeof` tells the cache how big a value is
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.disk_max_bytes = disk_max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = fork_safe_lock(self, threading.RLock)
+        self.hits = self.misses = self.disk_hits = 0
+        self.evictions = self.disk_evictions = 0
+        self.writes = 0
+        self.path = path
+        self._db = None
+        self._db_pid = None
+        self._inherited = None
+
+    # SQLite connections must not be used across fork(), so each process (e.g. the bulk
+    # CLI and API pool workers) opens its own on first use
+    @property
+    def db(self):
+        if self.path and self._db_pid != os.getpid():
+            with self.lock:
+                if self._db_pid != os.getpid():
+                    # The parent's connection is kept referenced but unused: closing it here
+                    # could release locks the parent still holds
+                    self._inherited, self._db = self._db, None
+                    try:
+                        self._db = self._open(self.path)
+                    except sqlite3.Error as e:
+                        log_event("cache_unavailable", f"Cache store {self.path} unavailable, using memory only: {e}", table=self.table, error=str(e))
+                    self._db_pid = os.getpid()
+        return self._db
+
+    def _open(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL lets several app processes share one cache file
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                   "(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL, size INTEGER)")
+        db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+        return db
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires, size = entry
+                if expires is None or expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.bytes -= size
+
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                self.hits += 1
+                self.disk_hits += 1
+                self._remember(key, *entry)
+                return entry[0]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self._remember(key, value, expires)
+            self._disk_set(key, value, expires)
+
+    def _remember(self, key, value, expires):
+        size = self.sizeof(value) if self.sizeof else 0
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[2]
+        self.entries[key] = (value, expires, size)
+        self.bytes += size
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                         or (self.max_bytes and self.bytes > self.max_bytes)):
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def _disk_get(self, key, now):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                self.db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self.db.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            return pickle.loads(row[0]), row[1]
+        except (sqlite3.Error, pickle.UnpicklingError) as e:
+            log_event("cache_error", f"Cache read error: {e}", table=self.table, op="read", error=str(e))
+            return None
+
+    def _disk_set(self, key, value, expires):
+        if self.db is None:
+            return
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self.db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                            (key, blob, expires, time.time(), len(blob)))
+            self.writes += 1
+            if self.writes % 64 == 0:
+                self._trim_disk()
+        except (sqlite3.Error, pickle.PicklingError) as e:
+            log_event("cache_error", f"Cache write error: {e}", table=self.table, op="write", error=str(e))
+
+    def _trim_disk(self):
+        self.db.execute(f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        excess = self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.disk_max_entries
+        if excess > 0:
+            self.db.execute(f"DELETE FROM {self.table} WHERE key IN "
+                            f"(SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)", (excess,))
+            self.disk_evictions += excess
+
+        if self.disk_max_bytes:
+            excess = (self.db.execute(f"SELECT SUM(size) FROM {self.table}").fetchone()[0] or 0) - self.disk_max_bytes
+            if excess > 0:
+                victims = []
+                for key, size in self.db.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed"):
+                    if excess <= 0:
+                        break
+                    victims.append((key,))
+                    excess -= size
+                self.db.executemany(f"DELETE FROM {self.table} WHERE key = ?", victims)
+                self.disk_evictions += len(victims)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            if self.db is not None:
+                self.db.execute(f"DELETE FROM {self.table}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": f"{(self.hits / lookups * 100) if lookups else 0:.1f}%"
+            }
+            if self.sizeof:
+                stats["memory_mb"] = round(self.bytes / 2 ** 20, 1)
+            return stats
+
+# Static translation catalog - a sorted table of (key hash, offsets) records followed by
+# the UTF-8 strings, memory-mapped so loading it costs nothing and lookups are a binary search
+CATALOG_MAGIC = b"ISCAT1\0\0"
+CATALOG_HEADER = struct.Struct("<8sI4x")
+CATALOG_RECORD = struct.Struct("<QIIII")  # key hash, key offset, key length, value offset, value length
+
+def catalog_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def compile_catalog(entries, path):
+    items = sorted((catalog_hash(k), k.encode("utf-8"), v.encode("utf-8")) for k, v in entries.items() if v)
+    offset = CATALOG_HEADER.size + CATALOG_RECORD.size * len(items)
+    records, blob = [], bytearray()
+    for key_hash, key, value in items:
+        records.append(CATALOG_RECORD.pack(key_hash, offset + len(blob), len(key),
+                                           offset + len(blob) + len(key), len(value)))
+        blob += key + value
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CATALOG_HEADER.pack(CATALOG_MAGIC, len(items)))
+        f.write(b"".join(records))
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return len(items)
+
+class StaticCatalog:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = CATALOG_HEADER.unpack_from(self.data, 0)
+        if magic != CATALOG_MAGIC:
+            raise ValueError(f"{path} is not a compiled translation catalog")
+
+    def _record(self, index):
+        return CATALOG_RECORD.unpack_from(self.data, CATALOG_HEADER.size + index * CATALOG_RECORD.size)
+
+    def get(self, text):
+        key_hash = catalog_hash(text)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key_hash:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        key = text.encode("utf-8")
+        for index in range(lo, self.count):
+            record_hash, key_offset, key_len, value_offset, value_len = self._record(index)
+            if record_hash != key_hash:
+                break
+            if self.data[key_offset:key_offset + key_len] == key:
+                return self.data[value_offset:value_offset + value_len].decode("utf-8")
+        return None
+
+def load_catalogs(directory=CATALOG_DIR):
+    catalogs = {}
+    if not os.path.isdir(directory):
+        return catalogs
+    for name in os.listdir(directory):
+        if name.endswith(".cat"):
+            try:
+                catalogs[name[:-4]] = StaticCatalog(os.path.join(directory, name))
+            except (OSError, ValueError, struct.error) as e:
+                log_event("catalog_skipped", f"Skipping translation catalog {name}: {e}", catalog=name, error=str(e))
+    return catalogs
+
 # Enhanced Translation with caching
+BATCH_SEPARATOR = "\n|||\n"
+BATCH_SPLIT = re.compile(r"\s*\|\s*\|\s*\|\s*")
+
 class InsuranceTranslator:
-    def __init__(self):
+    def __init__(self, cache=None, catalogs=None):
         self.translator = Translator()
-        self.cache = {}
+        self.cache = cache if cache is not None else LRUCache(TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL)
+        self.catalogs = catalogs or {}
         
+    def lookup_static(self, text, dest):
+        catalog = self.catalogs.get(dest)
+        return catalog.get(text) if catalog is not None else None
+
     def translate(self, text, dest="hi"):
         if not text or dest == "en":
             return text
             
+        static = self.lookup_static(text, dest)
+        if static is not None:
+            return static
+
         cache_key = f"{dest}:{text}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
             
         try:
-            translated = self.translator.translate(text, dest=dest).text
-            self.cache[cache_key] = translated
+            with get_metrics().span("translate", mode="single"):
+                translated = self.translator.translate(text, dest=dest).text
+            self.cache.set(cache_key, translated)
             return translated
         except Exception as e:
-            print(f"Translation error: {e}")
+            log_event("translation_error", f"Translation error: {e}", mode="single", error=str(e))
             return text
 
-translator = InsuranceTranslator()
+    def translate_many(self, texts, dest="hi"):
+        texts = list(texts)
+        if dest == "en":
+            return texts
+
+        results = {}
+        misses = []
+        for text in dict.fromkeys(texts):
+            cached = (self.lookup_static(text, dest) or self.cache.get(f"{dest}:{text}")) if text else text
+            if cached is None:
+                misses.append(text)
+            else:
+                results[text] = cached
+
+        # All misses go out joined in as few requests as the size limit allows
+        batches = self._pack(misses)
+        if len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(TRANSLATE_WORKERS, len(batches))) as pool:
+                translated = list(pool.map(lambda batch: self._translate_batch(batch, dest), batches))
+        else:
+            translated = [self._translate_batch(batch, dest) for batch in batches]
+
+        for batch, outputs in zip(batches, translated):
+            results.update(zip(batch, outputs))
+        return [results[text] for text in texts]
+
+    def _pack(self, texts):
+        batches, size = [], 0
+        for text in texts:
+            if not batches or size + len(text) + len(BATCH_SEPARATOR) > TRANSLATE_BATCH_CHARS:
+                batches.append([])
+                size = 0
+            batches[-1].append(text)
+            size += len(text) + len(BATCH_SEPARATOR)
+        return batches
+
+    def _translate_batch(self, batch, dest):
+        if len(batch) == 1:
+            return [self.translate(batch[0], dest)]
+        try:
+            with get_metrics().span("translate", mode="batch"):
+                joined = self.translator.translate(BATCH_SEPARATOR.join(batch), dest=dest).text
+        except Exception as e:
+            log_event("translation_error", f"Batch translation error: {e}", mode="batch", error=str(e))
+            return batch
+
+        parts = BATCH_SPLIT.split(joined.strip())
+        if len(parts) != len(batch):
+            # The separator got mangled - fall back to one request per text
+            log_event("translation_split_mismatch", f"Batch translation returned {len(parts)} parts for {len(batch)} texts, retrying individually",
+                      parts=len(parts), texts=len(batch))
+            return [self.translate(text, dest) for text in batch]
+
+        for text, part in zip(batch, parts):
+            self.cache.set(f"{dest}:{text}", part)
+        return parts
+
+# Streamlit re-executes this script on every interaction, so the translator and
+# its cache are created once per process and shared by all sessions
+@st.cache_resource
+def get_translator():
+    cache = LRUCache(TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL,
+                     path=TRANSLATION_CACHE_PATH, table="translations")
+    return InsuranceTranslator(cache, load_catalogs())
+
+translator = get_translator()
 
 # Image Processing Functions
-def enhance_image(image):
+DENOISERS = {
+    "nlm": lambda img: cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21),
+    "fast": lambda img: cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 5, 11),
+    "bilateral": lambda img: cv2.bilateralFilter(img, 7, 50, 50),
+    "none": lambda img: img
+}
+
+@st.cache_resource
+def get_image_executor():
+    return ThreadPoolExecutor(max_workers=max(1, ENHANCE_WORKERS), thread_name_prefix="enhance")
+
+def resize_to_working(img, max_side):
+    h, w = img.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return img
+    scale = max_side / max(h, w)
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+def denoise(img, denoiser, workers):
+    denoise_tile = DENOISERS[denoiser]
+    h, w = img.shape[:2]
+    if denoiser == "none" or workers <= 1 or max(h, w) <= ENHANCE_TILE:
+        return denoise_tile(img)
+
+    # Each tile is denoised with a margin wide enough for the filter window and
+    # only its interior is kept, so tiles join without seams
+    out = np.empty_like(img)
+    tile, pad = ENHANCE_TILE, ENHANCE_TILE_OVERLAP
+
+    def run(origin):
+        y, x = origin
+        y0, x0 = max(0, y - pad), max(0, x - pad)
+        y1, x1 = min(h, y + tile + pad), min(w, x + tile + pad)
+        result = denoise_tile(np.ascontiguousarray(img[y0:y1, x0:x1]))
+        out[y:y + tile, x:x + tile] = result[y - y0:y - y0 + tile, x - x0:x - x0 + tile]
+
+    list(get_image_executor().map(run, [(y, x) for y in range(0, h, tile) for x in range(0, w, tile)]))
+    return out
+
+# Decodes an upload straight into one contiguous RGB buffer at the working resolution.
+# JPEGs use DCT scaling (draft mode) so a 12MP photo is never materialized at full size.
+def decode_image(data, max_side=None):
+    max_side = ENHANCE_MAX_SIDE if max_side is None else max_side
+    image = Image.open(io.BytesIO(data))
+    if max_side and image.format == "JPEG" and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        image.draft("RGB", (max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return resize_to_working(np.array(image), max_side)
+
+# Works on an RGB uint8 array and reuses its buffers: the decoded array becomes the
+# output of the final sharpening pass, so only two full-size buffers are ever alive
+def enhance_array(img, denoiser=None, workers=None):
+    denoised = denoise(img, denoiser or ENHANCE_DENOISER, ENHANCE_WORKERS if workers is None else workers)
+    out = np.empty_like(img) if denoised is img else img
+
+    cv2.cvtColor(denoised, cv2.COLOR_BGR2LAB, dst=denoised)
+    l = cv2.extractChannel(denoised, 0)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    clahe.apply(l, dst=l)
+    cv2.insertChannel(l, denoised, 0)
+    cv2.cvtColor(denoised, cv2.COLOR_LAB2RGB, dst=denoised)
+
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+    cv2.filter2D(denoised, -1, kernel, dst=out)
+    return out
+
+def enhance_image(image, max_side=None, denoiser=None, workers=None):
     try:
-        img = np.array(image.convert('RGB'))
-        img = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        l = clahe.apply(l)
-        img = cv2.cvtColor(cv2.merge((l, a, b)), cv2.COLOR_LAB2RGB)
-        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
-        img = cv2.filter2D(img, -1, kernel)
-        return Image.fromarray(img)
+        img = resize_to_working(np.array(image.convert('RGB')), ENHANCE_MAX_SIDE if max_side is None else max_side)
+        return Image.fromarray(enhance_array(img, denoiser, workers))
     except Exception as e:
         st.error(f"Image processing error: {e}")
         return image
 
-def analyze_image(img):
+def damage_level(density):
+    if density > 0.15: return 'severe', 2.5
+    elif density > 0.08: return 'moderate', 1.5
+    elif density > 0.03: return 'minor', 1.0
+    else: return 'minimal', 0.5
+
+def grid_shape(h, w, grid):
+    if h >= w:
+        return grid, max(1, round(grid * w / h))
+    return max(1, round(grid * h / w)), grid
+
+# Per-tile sums for the whole grid from one integral image: four lookups per tile, no Python loops
+def tile_sums(integral, ys, xs):
+    return (integral[ys[1:, None], xs[None, 1:]] - integral[ys[:-1, None], xs[None, 1:]]
+            - integral[ys[1:, None], xs[None, :-1]] + integral[ys[:-1, None], xs[None, :-1]])
+
+def damage_regions(density, brightness, ys, xs, top_k):
+    # Local maxima of the density grid, ignoring tiles too dark or blown out to judge
+    peaks = (density == cv2.dilate(density, np.ones((3, 3), np.uint8))) & (density > 0)
+    peaks &= (brightness > 16) & (brightness < 240)
+    rows, cols = np.nonzero(peaks)
+    order = np.argsort(density[rows, cols])[::-1][:top_k]
+    return [{
+        'x': int(xs[c]), 'y': int(ys[r]), 'w': int(xs[c + 1] - xs[c]), 'h': int(ys[r + 1] - ys[r]),
+        'density': float(density[r, c]), 'brightness': float(brightness[r, c])
+    } for r, c in zip(rows[order], cols[order])]
+
+def analyze_image(img, grid=None, top_k=None):
+    grid = DAMAGE_GRID if grid is None else grid
+    top_k = top_k or DAMAGE_TOP_K
     try:
-        gray = np.array(img.convert('L'))
+        if isinstance(img, np.ndarray):
+            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = np.array(img.convert('L'))
         edges = cv2.Canny(gray, 50, 150)
-        density = edges.sum() / edges.size
+        h, w = gray.shape
         
-        if density > 0.15: level, mult = 'severe', 2.5
-        elif density > 0.08: level, mult = 'moderate', 1.5
-        elif density > 0.03: level, mult = 'minor', 1.0
-        else: level, mult = 'minimal', 0.5
-            
-        brightness = gray.mean()
+        # Global and per-tile figures all come from the same two integral images
+        edge_integral = cv2.integral(edges)
+        gray_integral = cv2.integral(gray)
+        density = edge_integral[h, w] / edges.size
+        brightness = gray_integral[h, w] / gray.size
         quality = min(100, max(0, 100 - abs(brightness - 128)/1.28))
         
-        return {
-            'damage_level': level,
-            'cost_multiplier': mult,
+        analysis = {
             'edge_density': f"{density*100:.2f}%",
             'quality_score': f"{quality:.1f}/100"
         }
+        
+        peak = density
+        if grid > 0:
+            rows, cols = grid_shape(h, w, grid)
+            ys = np.linspace(0, h, rows + 1).astype(np.intp)
+            xs = np.linspace(0, w, cols + 1).astype(np.intp)
+            area = np.outer(np.diff(ys), np.diff(xs))
+            tile_density = (tile_sums(edge_integral, ys, xs) / area).astype(np.float32)
+            tile_brightness = (tile_sums(gray_integral, ys, xs) / area).astype(np.float32)
+            regions = damage_regions(tile_density, tile_brightness, ys, xs, top_k)
+            if regions:
+                peak = regions[0]['density']
+            analysis['heatmap'] = tile_density.tolist()
+            analysis['regions'] = regions
+        
+        analysis['damage_level'], analysis['cost_multiplier'] = damage_level(peak)
+        return analysis
     except Exception as e:
         st.error(f"Analysis error: {e}")
-        return {
-            'damage_level': 'unknown',
-            'cost_multiplier': 1.0,
-            'edge_density': "0%",
-            'quality_score': "0/100"
-        }
+        return unknown_analysis()
+
+def unknown_analysis(error=None):
+    analysis = {
+        'damage_level': 'unknown',
+        'cost_multiplier': 1.0,
+        'edge_density': "0%",
+        'quality_score': "0/100"
+    }
+    if error:
+        analysis['error'] = error
+    return analysis
+
+# Colour-mapped tile densities blended over the photo, with the top regions outlined
+def render_heatmap(image, analysis, alpha=0.45):
+    base = np.array(image.convert('RGB'))
+    heatmap = np.asarray(analysis.get('heatmap') or [[0.0]], dtype=np.float32)
+    scaled = np.uint8(255 * heatmap / max(float(heatmap.max()), 1e-6))
+    h, w = base.shape[:2]
+    colours = cv2.applyColorMap(cv2.resize(scaled, (w, h), interpolation=cv2.INTER_NEAREST), cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(base, 1 - alpha, cv2.cvtColor(colours, cv2.COLOR_BGR2RGB), alpha, 0)
+    for region in analysis.get('regions', []):
+        x, y = region['x'], region['y']
+        cv2.rectangle(overlay, (x, y), (x + region['w'] - 1, y + region['h'] - 1), (255, 255, 255), 2)
+    return Image.fromarray(overlay)
+
+@st.cache_resource
+def get_image_cache():
+    return LRUCache(10000, path=IMAGE_CACHE_PATH, table="images",
+                    max_bytes=IMAGE_CACHE_MB * 2 ** 20, sizeof=lambda value: len(value[0]),
+                    disk_max_bytes=IMAGE_CACHE_DISK_MB * 2 ** 20)
+
+def image_cache_key(data):
+    params = f"v{IMAGE_PIPELINE_VERSION}:{ENHANCE_MAX_SIDE}:{ENHANCE_DENOISER}:{DAMAGE_GRID}:{DAMAGE_TOP_K}"
+    return f"{hashlib.sha256(data).hexdigest()}:{params}"
+
+# Full enhance + analyze pipeline for one photo. Runs in worker processes, so it only
+# returns plain data: the enhanced image as JPEG bytes, the analysis dict and stage timings
+# (recorded by the caller, whose process holds the metrics).
+def run_image_pipeline(data, workers=None):
+    timings = {}
+    start = time.perf_counter()
+    pixels = decode_image(data)
+    timings["image_decode"], start = time.perf_counter() - start, time.perf_counter()
+    pixels = enhance_array(pixels, workers=workers)
+    timings["image_enhance"], start = time.perf_counter() - start, time.perf_counter()
+    analysis = analyze_image(pixels)
+    timings["image_analyze"] = time.perf_counter() - start
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue(), analysis, timings
+
+def record_timings(timings):
+    metrics = get_metrics()
+    for stage, seconds in timings.items():
+        metrics.observe("stage_seconds", seconds, stage=stage)
+
+@st.cache_resource
+def get_process_pool():
+    # Fork where available: workers start instantly and need not re-import the Streamlit script
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    return ProcessPoolExecutor(max_workers=max(1, IMAGE_PROCESS_WORKERS), mp_context=context)
+
+# Enhance + analyze uploaded photos, reusing earlier results for identical bytes.
+# Yields (index, enhanced image, analysis) as each photo finishes, cached ones first.
+def process_images(uploads):
+    cache = get_image_cache()
+    pending = {}
+    for index, data in enumerate(uploads):
+        key = image_cache_key(data)
+        cached = cache.get(key)
+        if cached is not None:
+            get_metrics().inc("image_cache_hits_total")
+            yield index, Image.open(io.BytesIO(cached[0])), cached[1]
+        else:
+            pending.setdefault(key, []).append(index)
+
+    if len(pending) > 1 and IMAGE_PROCESS_WORKERS > 1:
+        # One photo per process; tiling threads inside each worker would only oversubscribe the CPUs
+        pool = get_process_pool()
+        futures = {pool.submit(run_image_pipeline, uploads[indexes[0]], 1): key for key, indexes in pending.items()}
+        results = ((futures[future], future.result) for future in as_completed(futures))
+    else:
+        futures = {}
+        results = ((key, functools.partial(run_image_pipeline, uploads[indexes[0]])) for key, indexes in pending.items())
+
+    try:
+        for key, result in results:
+            try:
+                encoded, analysis, timings = result()
+            except Exception as e:
+                # One unreadable photo must not fail the others: show it as uploaded, severity unknown
+                get_metrics().inc("image_errors_total")
+                log_event("image_error", f"Image processing error: {e}", error=str(e))
+                for index in pending[key]:
+                    yield index, original_photo(uploads[index]), unknown_analysis(str(e))
+                continue
+            record_timings(timings)
+            cache.set(key, (encoded, analysis))
+            for index in pending[key]:
+                yield index, Image.open(io.BytesIO(encoded)), analysis
+    finally:
+        # Consumer stopped early (e.g. a cancelled job): drop the photos not yet started
+        for future in futures:
+            future.cancel()
+
+def original_photo(data):
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+    except Exception:
+        return Image.new("RGB", (320, 240), (128, 128, 128))
+
+def process_image(data):
+    _, enhanced, analysis = next(process_images([data]))
+    return enhanced, analysis
+
+DAMAGE_LEVELS = [("severe", 2.5), ("moderate", 1.5), ("minor", 1.0), ("minimal", 0.5)]
+
+def combine_analyses(analyses, method=None):
+    if len(analyses) == 1:
+        return analyses[0]
+    known = [a for a in analyses if a["damage_level"] != "unknown"] or analyses
+
+    if (method or DAMAGE_COMBINE) == "weighted":
+        weights = [float(a["quality_score"].split("/")[0]) for a in known]
+        if not sum(weights):
+            weights = [1] * len(known)
+        mult = sum(w * a["cost_multiplier"] for w, a in zip(weights, known)) / sum(weights)
+        level = next((name for name, level_mult in DAMAGE_LEVELS if mult >= level_mult), "minimal")
+    else:
+        worst = max(known, key=lambda a: a["cost_multiplier"])
+        level, mult = worst["damage_level"], worst["cost_multiplier"]
+
+    return {
+        'damage_level': level,
+        'cost_multiplier': mult,
+        'photos': len(analyses)
+    }
 
 # Cost Estimation
 CLAIM_TYPE_BASES = {
@@ -124,46 +969,457 @@ CLAIM_TYPE_BASES = {
     "Home": {"severe": (100000,500000), "moderate": (30000,100000), "minor": (5000,30000)}
 }
 
-def estimate_repair_cost(desc, analysis, claim_type):
-    base = CLAIM_TYPE_BASES.get(claim_type, CLAIM_TYPE_BASES["Vehicle"])
-    severity = next((k for k in ["severe","moderate","minor"] 
-                   if k in desc.lower() or analysis["damage_level"]==k), "moderate")
-    low, high = base.get(severity, base["moderate"])
-    return (int(low * analysis["cost_multiplier"]), int(high * analysis["cost_multiplier"]))
+# Tariff table as NumPy arrays so whole portfolios are priced with fancy indexing
+class Tariff:
+    def __init__(self, data):
+        self.version = str(data.get("version", "builtin"))
+        self.severities = list(data.get("severities", ["severe", "moderate", "minor"]))
+        self.default_severity = data.get("default_severity", "moderate")
+        self.claim_types = list(data["base"])
+        self.default_claim_type = data.get("default_claim_type", self.claim_types[0])
+        self.base = np.array([[data["base"][t].get(sev, data["base"][t][self.default_severity]) for sev in self.severities]
+                              for t in self.claim_types], dtype=np.float64)
+        self.regions = {"default": 1.0, **data.get("regions", {})}
+        classes = data.get("classes", {})
+        self.classes = sorted({name for t in self.claim_types for name in classes.get(t, {})} | {"default"})
+        self.class_factors = np.array([[classes.get(t, {}).get(name, classes.get(t, {}).get("default", 1.0)) for name in self.classes]
+                                       for t in self.claim_types], dtype=np.float64)
+        self.sigma = float(data.get("monte_carlo", {}).get("sigma", 0.25))
+    
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+    
+    @staticmethod
+    def codes(values, names, default):
+        # Unique values are looked up once; unknown names map to the default
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        lookup = np.array([names.index(u) if u in names else names.index(default) for u in uniques], dtype=np.intp)
+        return lookup[inverse.reshape(-1)]
+    
+    def factors(self, type_codes, regions=None, classes=None):
+        n = len(type_codes)
+        factor = np.ones(n)
+        if regions is not None:
+            names = list(self.regions)
+            factor = factor * np.array(list(self.regions.values()))[self.codes(regions, names, "default")]
+        if classes is not None:
+            factor = factor * self.class_factors[type_codes, self.codes(classes, self.classes, "default")]
+        return factor
+    
+    # (n, 2) int64 low/high ranges; matches estimate_repair_cost claim for claim
+    def estimate_batch(self, claim_types, severities, multipliers, regions=None, classes=None):
+        types = self.codes(claim_types, self.claim_types, self.default_claim_type)
+        ranges = self.base[types, self.codes(severities, self.severities, self.default_severity)]
+        # A single multiplier applies to every claim
+        scale = np.broadcast_to(np.asarray(multipliers, dtype=np.float64), types.shape)
+        if regions is not None or classes is not None:
+            scale = scale * self.factors(types, regions, classes)
+        return (ranges * scale[:, None]).astype(np.int64)
+    
+    # Monte Carlo cost per claim: uniform within the tariff range times mean-one lognormal
+    # noise. Claims are simulated in chunks so memory stays bounded; returns per-claim
+    # percentiles (n, len(percentiles)) and the same percentiles of the portfolio total.
+    def simulate(self, claim_types, severities, multipliers, regions=None, classes=None,
+                 samples=1000, percentiles=(5, 50, 95), seed=None, chunk_cells=4_000_000):
+        ranges = self.estimate_batch(claim_types, severities, multipliers, regions, classes).astype(np.float64)
+        rng = np.random.default_rng(seed)
+        per_claim = np.empty((len(ranges), len(percentiles)))
+        totals = np.zeros(samples)
+        step = max(1, chunk_cells // samples)
+        for start in range(0, len(ranges), step):
+            low, high = ranges[start:start + step, :1], ranges[start:start + step, 1:]
+            draws = low + (high - low) * rng.random((len(low), samples))
+            draws *= rng.lognormal(-self.sigma ** 2 / 2, self.sigma, draws.shape)
+            per_claim[start:start + step] = np.percentile(draws, percentiles, axis=1).T
+            totals += draws.sum(axis=0)
+        return per_claim, np.percentile(totals, percentiles)
+
+def builtin_tariff():
+    return Tariff({"version": "builtin", "base": CLAIM_TYPE_BASES, "default_claim_type": "Vehicle"})
+
+@st.cache_resource
+def get_tariff():
+    try:
+        return Tariff.from_file(TARIFF_PATH)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log_event("tariff_fallback", f"Using built-in repair tariffs ({TARIFF_PATH}: {e})", path=TARIFF_PATH, error=str(e))
+        return builtin_tariff()
+
+# Severity per claim, same rule as estimate_repair_cost: the first of severe/moderate/minor
+# named in the description or matching the photo analysis, else the default
+def claim_severities(descs, damage_levels, tariff=None):
+    tariff = tariff or get_tariff()
+    # Lowered before the array is built: np.char.lower keeps the fixed width, which cuts off
+    # text that lowercasing lengthens ("İ" becomes two characters)
+    lowered = np.asarray([str(desc).lower() for desc in descs], dtype=str)
+    levels = np.asarray(damage_levels, dtype=str)
+    matches = np.stack([(np.char.find(lowered, sev) >= 0) | (levels == sev) for sev in tariff.severities], axis=1)
+    chosen = np.array(tariff.severities)[matches.argmax(axis=1)]
+    return np.where(matches.any(axis=1), chosen, tariff.default_severity)
+
+def estimate_repair_cost(desc, analysis, claim_type, region=None, vehicle_class=None):
+    tariff = get_tariff()
+    severity = next((k for k in tariff.severities
+                   if k in desc.lower() or analysis["damage_level"]==k), tariff.default_severity)
+    claim_type = claim_type if claim_type in tariff.claim_types else tariff.default_claim_type
+    types = tariff.claim_types.index(claim_type)
+    low, high = tariff.base[types, tariff.severities.index(severity)]
+    mult = analysis["cost_multiplier"]
+    if region is not None or vehicle_class is not None:
+        mult = mult * tariff.factors(np.array([types]), None if region is None else [region],
+                                     None if vehicle_class is None else [vehicle_class])[0]
+    return (int(low * mult), int(high * mult))
+
+# Document Issue Scanner
+DEFAULT_ISSUE_RULES = [
+    {"id": "cash", "pattern": "cash", "message": "Cash payment detected"},
+    {"id": "duplicate", "pattern": "duplicate", "message": "Possible duplicate bill"},
+    {"id": "missing", "pattern": "missing", "message": "Missing information found"},
+    {"id": "expired", "pattern": "expired", "message": "Expired document detected"}
+]
+
+# Aho-Corasick automaton flattened into a DFA: one dict lookup per character,
+# however many literals are loaded
+class KeywordAutomaton:
+    def __init__(self, keywords):
+        self.goto, self.out = [{}], [[]]
+        for word, payload in keywords:
+            state = 0
+            for ch in word:
+                if ch not in self.goto[state]:
+                    self.goto[state][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.out.append([])
+                state = self.goto[state][ch]
+            self.out[state].append((len(word), payload))
+        
+        # Breadth-first, so a state's fail target is always complete before the state itself
+        fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                fail[child] = self.goto[fail[state]].get(ch, 0)
+                self.out[child] = self.out[child] + self.out[fail[child]]
+                queue.append(child)
+            for ch, target in self.goto[fail[state]].items():
+                self.goto[state].setdefault(ch, target)
+    
+    def finditer(self, text):
+        goto, out, state = self.goto, self.out, 0
+        for end, ch in enumerate(text, 1):
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, payload in out[state]:
+                    yield end - length, end, payload
+
+def lower_keep_offsets(text):
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # A few characters (e.g. "İ") grow when lowercased; leave those alone so offsets still line up
+    return "".join(low if len(low) == 1 else ch for ch, low in ((ch, ch.lower()) for ch in text))
+
+class IssueScanner:
+    def __init__(self, rules, fingerprint=""):
+        self.rules = [dict({"type": "literal", "severity": "review", "category": "general"}, **rule) for rule in rules]
+        self.fingerprint = fingerprint
+        literals = [rule for rule in self.rules if rule["type"] == "literal"]
+        # Case-insensitive literals run over the lowercased text, case-sensitive ones over the original
+        self.keywords = KeywordAutomaton([(rule["pattern"].lower(), rule) for rule in literals if not rule.get("case_sensitive")])
+        self.exact_keywords = KeywordAutomaton([(rule["pattern"], rule) for rule in literals if rule.get("case_sensitive")])
+        
+        # All regex rules in one pattern, so each page is read once: a lookahead over their
+        # alternation finds the positions where some rule matches, then every rule gets an
+        # optional lookahead with its own named group there. Hits of different rules may overlap.
+        self.regex_rules = [rule for rule in self.rules if rule["type"] == "regex"]
+        self.regex = None
+        if self.regex_rules:
+            parts = [f"(?{'-' if rule.get('case_sensitive') else ''}i:{rule['pattern']})" for rule in self.regex_rules]
+            self.regex = re.compile(f"(?={'|'.join(parts)})" +
+                                    "".join(f"(?:(?=(?P<r{i}>{part}))|)" for i, part in enumerate(parts)))
+            self.regex_groups = [self.regex.groupindex[f"r{i}"] for i in range(len(parts))]
+    
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        return cls(json.loads(raw)["rules"], hashlib.sha256(raw).hexdigest()[:16])
+    
+    def scan_page(self, text, page=1):
+        hits = []
+        for automaton, scanned in ((self.keywords, lower_keep_offsets(text)), (self.exact_keywords, text)):
+            if len(automaton.goto) == 1:
+                continue  # no literals of this kind
+            for start, end, rule in automaton.finditer(scanned):
+                if rule.get("word") and ((start and scanned[start - 1].isalnum()) or (end < len(scanned) and scanned[end].isalnum())):
+                    continue
+                hits.append(self.hit(rule, text, start, end, page))
+        if self.regex:
+            # A rule's hits never overlap each other, as with its own finditer
+            ends = [0] * len(self.regex_rules)
+            for match in self.regex.finditer(text):
+                spans = match.regs  # (-1, -1) for rules that did not match here
+                for i, group in enumerate(self.regex_groups):
+                    start, end = spans[group]
+                    if start >= ends[i]:
+                        ends[i] = end
+                        hits.append(self.hit(self.regex_rules[i], text, start, end, page))
+        return sorted(hits, key=lambda hit: hit["offset"])
+    
+    def hit(self, rule, text, start, end, page):
+        return {"rule": rule["id"], "message": rule["message"], "category": rule["category"],
+                "severity": rule["severity"], "page": page, "offset": start, "match": text[start:end]}
+    
+    def scan(self, pages):
+        for page, text in enumerate(pages, 1):
+            yield from self.scan_page(text, page)
+
+@st.cache_resource
+def get_issue_scanner():
+    try:
+        return IssueScanner.from_file(DOCUMENT_RULES_PATH)
+    except (OSError, ValueError, KeyError, re.error) as e:
+        log_event("rules_fallback", f"Using built-in document rules ({DOCUMENT_RULES_PATH}: {e})", path=DOCUMENT_RULES_PATH, error=str(e))
+        return IssueScanner(DEFAULT_ISSUE_RULES, "builtin")
 
 # Health Document Processor
+@st.cache_resource
+def get_document_cache():
+    return LRUCache(1000, path=DOCUMENT_CACHE_PATH, table="documents",
+                    max_bytes=DOCUMENT_CACHE_MB * 2 ** 20, sizeof=lambda doc: sum(len(page) for page in doc["pages"]),
+                    disk_max_bytes=DOCUMENT_CACHE_DISK_MB * 2 ** 20)
+
+def document_cache_key(file_bytes):
+    return f"{hashlib.sha256(file_bytes).hexdigest()}:{PDF_MAX_PAGES}"
+
+# Start of the pages as joined text, without joining the whole document
+def document_head(pages, limit=PDF_SUMMARY_CHARS):
+    parts, size = [], -1
+    for page in pages:
+        parts.append(page)
+        size += len(page) + 1
+        if size > limit:
+            break
+    return "\n".join(parts)
+
+# Picklable worker for the process pool: text of pages [start, stop) of a PDF
+def extract_page_range(file_bytes, start, stop):
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        return [doc[number].get_text() for number in range(start, stop)]
+
 class HealthAgent:
-    def __init__(self, lang):
+    # parallel=False reads every page in-process, for callers that already run in a pool worker
+    def __init__(self, lang, parallel=True):
         self.lang = lang
+        self.parallel = parallel
+        self.pages_total = 0
+        self.pages_read = 0
+        self.hits = []
+        self.error = None
+        
+    # Yields page texts in page order, reading ranges in worker processes for large documents
+    def iter_pages(self, file_bytes, progress=None, max_pages=None, timeout=None):
+        max_pages = max_pages or PDF_MAX_PAGES
+        deadline = time.monotonic() + (timeout or PDF_TIMEOUT)
+        self.pages_read = 0
+        
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+            self.pages_total = len(doc)
+            count = min(self.pages_total, max_pages)
+            if count < PDF_PARALLEL_PAGES or IMAGE_PROCESS_WORKERS <= 1 or not self.parallel:
+                for number in range(count):
+                    if time.monotonic() > deadline:
+                        return
+                    yield doc[number].get_text()
+                    self.pages_read += 1
+                    if progress:
+                        progress(self.pages_read, count)
+                return
+        
+        pool = get_process_pool()
+        futures = [pool.submit(extract_page_range, file_bytes, start, min(start + PDF_CHUNK_PAGES, count))
+                   for start in range(0, count, PDF_CHUNK_PAGES)]
+        try:
+            # Ranges finish out of order, but waiting on them in order keeps the text ordered
+            for future in futures:
+                for text in future.result(timeout=max(0, deadline - time.monotonic())):
+                    yield text
+                    self.pages_read += 1
+                if progress:
+                    progress(self.pages_read, count)
+        except FutureTimeout:
+            return
+        finally:
+            for future in futures:
+                future.cancel()
         
     def extract_text(self, file_bytes):
         try:
-            with fitz.open(stream=io.BytesIO(file_bytes), filetype="pdf") as doc:
-                return "\n".join(page.get_text() for page in doc)
+            return "\n".join(self.iter_pages(file_bytes))
         except Exception as e:
             return f"PDF error: {e}"
             
     def identify_issues(self, text):
-        issues = {
-            "cash": "Cash payment detected",
-            "duplicate": "Possible duplicate bill",
-            "missing": "Missing information found",
-            "expired": "Expired document detected"
-        }
-        return [issues[k] for k in issues if k in text.lower()]
+        flags = []
+        for hit in get_issue_scanner().scan_page(text):
+            if hit["severity"] == "review" and hit["message"] not in flags:
+                flags.append(hit["message"])
+        return flags
+        
+    # Extracts and scans page by page; on_summary gets the summary as soon as the first
+    # pages provide it. Raises fitz.FileDataError for files that are not readable PDFs.
+    def read_document(self, file_bytes, progress=None, on_summary=None):
+        scanner = get_issue_scanner()
+        pages, hits, length = [], [], -1
+        start, scanning = time.perf_counter(), 0.0
+        for page in self.iter_pages(file_bytes, progress):
+            before, length = length, length + len(page) + 1
+            if on_summary and before <= PDF_SUMMARY_CHARS < length:
+                on_summary(document_head(pages + [page])[:PDF_SUMMARY_CHARS] + "...")
+            scan_start = time.perf_counter()
+            hits += scanner.scan_page(page, len(pages) + 1)
+            scanning += time.perf_counter() - scan_start
+            pages.append(page)
+        metrics = get_metrics()
+        metrics.observe("stage_seconds", time.perf_counter() - start - scanning, stage="pdf_extract")
+        metrics.observe("stage_seconds", scanning, stage="pdf_scan")
+        return {"pages": pages, "hits": hits, "pages_total": self.pages_total,
+                "pages_read": self.pages_read, "rules": scanner.fingerprint}
+    
+    # Known documents come from the cache; hits are rescanned from the stored text if the
+    # rules changed since. Documents cut off by the timeout are not cached.
+    def load_document(self, file_bytes, progress=None, on_summary=None):
+        cache = get_document_cache()
+        key = document_cache_key(file_bytes)
+        doc = cache.get(key)
+        if doc is None:
+            doc = self.read_document(file_bytes, progress, on_summary)
+            if doc["pages_read"] == min(doc["pages_total"], PDF_MAX_PAGES):
+                cache.set(key, doc)
+        elif doc["rules"] != get_issue_scanner().fingerprint:
+            scanner = get_issue_scanner()
+            doc = dict(doc, hits=list(scanner.scan(doc["pages"])), rules=scanner.fingerprint)
+            cache.set(key, doc)
+        self.pages_total, self.pages_read = doc["pages_total"], doc["pages_read"]
+        return doc
+    
+    # Only the scenario and translation are per-request; the document itself is cached
+    def generate_report(self, file_bytes, scenario, progress=None, on_summary=None):
+        self.error = None
+        try:
+            doc = self.load_document(file_bytes, progress, on_summary)
+            self.hits = doc["hits"]
+            length = sum(map(len, doc["pages"])) + max(0, len(doc["pages"]) - 1)
+            head = document_head(doc["pages"])
+        except Exception as e:
+            self.hits, self.error = [], str(e)
+            head, length = f"PDF error: {e}", 0
         
-    def generate_report(self, file_bytes, scenario):
-        text = self.extract_text(file_bytes)
-        flags = self.identify_issues(text)
-        summary = text[:500] + ("..." if len(text) > 500 else "")
+        # Review-level rules become report flags, with the first pages they were found on
+        pages = {}
+        for hit in self.hits:
+            if hit["severity"] == "review" and hit["page"] not in pages.setdefault(hit["message"], []):
+                pages[hit["message"]].append(hit["page"])
+        flags = [f"{message} (p. {', '.join(map(str, found[:3]))}{', ...' if len(found) > 3 else ''})"
+                 for message, found in pages.items()]
+        summary = head[:PDF_SUMMARY_CHARS] + ("..." if length > PDF_SUMMARY_CHARS else "")
         
-        report = (
-            f"📖 Scenario: {scenario}\n\n"
-            f"📄 Document Summary: {summary or 'No text found in document'}\n\n"
-            f"🚩 Potential Issues Found: {', '.join(flags) if flags else 'No issues detected'}\n\n"
+        # Translated per section so the fixed lines come straight from the cache
+        sections = [
+            f"📖 Scenario: {scenario}",
+            f"📄 Document Summary: {summary or 'No text found in document'}",
+            f"🚩 Potential Issues Found: {', '.join(flags) if flags else 'No issues detected'}",
             f"✅ Status: {'Requires review' if flags else 'Document appears complete'}"
-        )
-        return translator.translate(report, self.lang)
+        ]
+        if self.pages_read < self.pages_total:
+            sections.append(f"⚠️ Only the first {self.pages_read} of {self.pages_total} pages were analyzed")
+        return "\n\n".join(translator.translate_many(sections, self.lang))
+
+# Document Retrieval
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Rough token count for prompt budgeting (~4 characters per token)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def chunk_pages(pages, size=None, overlap=None):
+    size = size or RETRIEVAL_CHUNK_WORDS
+    step = max(1, size - (overlap if overlap is not None else RETRIEVAL_OVERLAP_WORDS))
+    chunks = []
+    for number, text in enumerate(pages, 1):
+        words = text.split()
+        for start in range(0, max(len(words) - size + step, 1), step):
+            if words[start:start + size]:
+                chunks.append((number, " ".join(words[start:start + size])))
+    return chunks
+
+# Okapi BM25 over postings sorted by term: the per-posting weights are precomputed, so a
+# query is one slice-and-add per query term
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.pages = np.array([page for page, _ in chunks], dtype=np.int32)
+        self.texts = [text for _, text in chunks]
+        self.vocab = {}
+        terms, docs, counts = [], [], []
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for index, (_, text) in enumerate(chunks):
+            tokens = Counter(TOKEN_PATTERN.findall(text.lower()))
+            lengths[index] = sum(tokens.values())
+            for token, count in tokens.items():
+                terms.append(self.vocab.setdefault(token, len(self.vocab)))
+                docs.append(index)
+                counts.append(count)
+        
+        terms = np.array(terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        terms = terms[order]
+        self.docs = np.array(docs, dtype=np.int32)[order]
+        tf = np.array(counts, dtype=np.float32)[order]
+        self.offsets = np.searchsorted(terms, np.arange(len(self.vocab) + 1))
+        
+        df = np.diff(self.offsets)
+        idf = np.log1p((len(chunks) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()) if len(chunks) else 0, 1))
+        self.weights = (idf[terms] * tf * (k1 + 1) / (tf + norm[self.docs])).astype(np.float32)
+    
+    def search(self, query, top_k):
+        scores = np.zeros(len(self.texts), dtype=np.float32)
+        for token in set(TOKEN_PATTERN.findall(query.lower())):
+            term = self.vocab.get(token)
+            if term is not None:
+                start, stop = self.offsets[term], self.offsets[term + 1]
+                scores[self.docs[start:stop]] += self.weights[start:stop]
+        matched = np.flatnonzero(scores)
+        best = matched[np.argsort(scores[matched])[::-1][:top_k]]
+        return [(float(scores[i]), int(self.pages[i]), self.texts[i]) for i in best]
+
+@st.cache_resource
+def get_index_cache():
+    return LRUCache(64)
+
+# Index per document, built from the cached page text on first use
+def get_document_index(file_bytes):
+    key = document_cache_key(file_bytes)
+    index = get_index_cache().get(key)
+    if index is None:
+        doc = HealthAgent("en").load_document(file_bytes)
+        index = BM25Index(chunk_pages(doc["pages"]))
+        get_index_cache().set(key, index)
+    return index
+
+# Best passages for a question that fit the token budget, tagged for citation
+def document_context(index, question, name="document", top_k=None, budget=None):
+    budget = budget or RETRIEVAL_TOKENS
+    passages, used = [], 0
+    for _, page, text in index.search(question, top_k or RETRIEVAL_TOP_K):
+        cost = estimate_tokens(text)
+        if used + cost <= budget:
+            passages.append(f"[{name} p.{page}] {text}")
+            used += cost
+    return "\n".join(passages)
 
 # Enhanced Default Responses - More detailed and human-friendly
 DEFAULT_RESPONSES = {
@@ -302,164 +1558,1024 @@ DEFAULT_RESPONSES = {
     }
 }
 
-# Enhanced LLM Query with better error handling and debugging
-def query_llm(prompt, provider, lang="en", claim_type=None, context=None):
-    system_messages = {
-        "Vehicle": {
-            "en": "You are a helpful vehicle insurance expert. Provide detailed, accurate information about insurance claims, required documents, and step-by-step guidance. Be empathetic and understanding as people dealing with vehicle accidents are often stressed. Always provide practical, actionable advice.",
-            "hi": "आप एक सहायक वाहन बीमा विशेषज्ञ हैं। बीमा दावों, आवश्यक दस्तावेजों और चरणबद्ध मार्गदर्शन के बारे में विस्तृत, सटीक जानकारी प्रदान करें। सहानुभूतिपूर्ण और समझदार बनें क्योंकि वाहन दुर्घटना से निपटने वाले लोग अक्सर तनावग्रस्त होते हैं।"
-        },
-        "Health": {
-            "en": "You are a compassionate health insurance specialist. Help people navigate medical insurance claims with clear explanations. Be sensitive to their health concerns and provide step-by-step guidance for claim procedures and required documents.",
-            "hi": "आप एक दयालु स्वास्थ्य बीमा विशेषज्ञ हैं। लोगों को स्पष्ट व्याख्या के साथ चिकित्सा बीमा दावों में मार्गदर्शन करने में मदद करें। उनकी स्वास्थ्य चिंताओं के प्रति संवेदनशील रहें।"
-        },
-        "Home": {
-            "en": "You are a knowledgeable home insurance consultant. Help people understand property insurance claims, required documentation, and the claims process. Be supportive as property damage can be very stressful for families.",
-            "hi": "आप एक जानकार गृह बीमा सलाहकार हैं। लोगों को संपत्ति बीमा दावों, आवश्यक दस्तावेजों और दावा प्रक्रिया को समझने में मदद करें।"
+def default_response(claim_type, lang):
+    responses = DEFAULT_RESPONSES.get(claim_type, DEFAULT_RESPONSES["Vehicle"])
+    # Hand-written versions are already in the target language - never send them to the translator
+    return responses.get(lang) or translator.translate(responses["en"], lang)
+
+# Headless claim assessment (bulk CLI / API) - the CPU-bound part of a claim: photos,
+# cost estimate and document scan, without any Streamlit calls
+def review_flags(hits):
+    return list(dict.fromkeys(hit["message"] for hit in hits if hit["severity"] == "review"))
+
+# workers=1 keeps the whole claim in the calling process (no threads, no nested process pool)
+def assess_claim(claim_type, scenario, images=(), pdf=None, lang="en", workers=None):
+    metrics = get_metrics()
+    before = metrics.state()
+    result = {"claim_type": claim_type}
+    if images:
+        analyses = []
+        for data in images:
+            try:
+                _, photo_analysis, timings = run_image_pipeline(data, workers)
+                record_timings(timings)
+                analyses.append(photo_analysis)
+            except Exception as e:
+                analyses.append(unknown_analysis(str(e)))
+        damage = combine_analyses(analyses)
+        result["photos"] = [{k: v for k, v in a.items() if k != "heatmap"} for a in analyses]
+        result["damage"] = {k: damage[k] for k in ("damage_level", "cost_multiplier")}
+        result["estimate"] = list(estimate_repair_cost(scenario, damage, claim_type))
+    if pdf is not None:
+        agent = HealthAgent(lang, parallel=workers != 1)
+        report = agent.generate_report(pdf, scenario)
+        result["document"] = {
+            "pages": agent.pages_total,
+            "pages_read": agent.pages_read,
+            "flags": review_flags(agent.hits),
+            "hits": len(agent.hits),
+            "report": report,
+            "error": agent.error  # set when the file could not be read as a PDF
         }
+    # Stage timings and counters recorded here; callers running this in a pool worker
+    # merge them into their own metrics (Metrics.merge)
+    result["metrics"] = metrics.since(before)
+    return result
+
+# Context for the follow-up LLM question, built from an assessment
+def claim_context(claim_type, scenario, assessment):
+    context = f"{claim_type} claim scenario: {scenario}"
+    if "damage" in assessment:
+        context += f". Image analysis shows {assessment['damage']['damage_level']} damage level."
+    if assessment.get("document", {}).get("flags"):
+        context += f" Document review flagged: {', '.join(assessment['document']['flags'])}."
+    return context
+
+# Enhanced LLM Query with better error handling and debugging
+LANGUAGES = ["en", "hi"]
+SYSTEM_MESSAGES = {
+    "Vehicle": {
+        "en": "You are a helpful vehicle insurance expert. Provide detailed, accurate information about insurance claims, required documents, and step-by-step guidance. Be empathetic and understanding as people dealing with vehicle accidents are often stressed. Always provide practical, actionable advice.",
+        "hi": "आप एक सहायक वाहन बीमा विशेषज्ञ हैं। बीमा दावों, आवश्यक दस्तावेजों और चरणबद्ध मार्गदर्शन के बारे में विस्तृत, सटीक जानकारी प्रदान करें। सहानुभूतिपूर्ण और समझदार बनें क्योंकि वाहन दुर्घटना से निपटने वाले लोग अक्सर तनावग्रस्त होते हैं।"
+    },
+    "Health": {
+        "en": "You are a compassionate health insurance specialist. Help people navigate medical insurance claims with clear explanations. Be sensitive to their health concerns and provide step-by-step guidance for claim procedures and required documents.",
+        "hi": "आप एक दयालु स्वास्थ्य बीमा विशेषज्ञ हैं। लोगों को स्पष्ट व्याख्या के साथ चिकित्सा बीमा दावों में मार्गदर्शन करने में मदद करें। उनकी स्वास्थ्य चिंताओं के प्रति संवेदनशील रहें।"
+    },
+    "Home": {
+        "en": "You are a knowledgeable home insurance consultant. Help people understand property insurance claims, required documentation, and the claims process. Be supportive as property damage can be very stressful for families.",
+        "hi": "आप एक जानकार गृह बीमा सलाहकार हैं। लोगों को संपत्ति बीमा दावों, आवश्यक दस्तावेजों और दावा प्रक्रिया को समझने में मदद करें।"
     }
+}
 
-    system_msg = system_messages.get(claim_type, system_messages["Vehicle"])[lang]
+def build_prompt(prompt, lang="en", claim_type=None, context=None):
+    system_msg = SYSTEM_MESSAGES.get(claim_type, SYSTEM_MESSAGES["Vehicle"])[lang]
     full_prompt = f"{system_msg}\n\nContext: {context}\nQuestion: {prompt}\nPlease provide a helpful, detailed response:"
+    return system_msg, full_prompt
 
-    print(f"Attempting to query {provider} with prompt length: {len(full_prompt)}")
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            print(f"Attempt {attempt + 1} with {provider}")
-            
-            if provider == "ollama":
-                # Check if Ollama is running
+def provider_configured(provider):
+    return {
+        "ollama": True,
+        "groq": bool(GROQ_API_KEY),
+        "gemini": bool(GEMINI_API_KEY),
+        "huggingface": bool(HF_TOKEN)
+    }.get(provider, False)
+
+# Per-provider circuit breaker - opens after repeated failures, then lets a single
+# probe request through once the reset timeout has passed
+class CircuitBreaker:
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open":
+                if self.probing:
+                    return False
+                self.probing = True
+            return self.state != "open"
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def cancel(self):
+        # The admitted request never reached the provider - free the probe slot
+        with self.lock:
+            self.probing = False
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst=None, path=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst or max(1, rate_per_minute // 6)
+        self.path = path if fcntl else None
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _refill_and_take(self, tokens, updated, now):
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0
+        return tokens, (1 - tokens) / self.rate
+
+    def _take(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.time()
+        with self.lock:
+            if self.path is None:
+                self.tokens, wait_for = self._refill_and_take(self.tokens, self.updated, now)
+                self.updated = now
+                return wait_for
+
+            with open(self.path, "a+b") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
                 try:
-                    health_response = requests.get(f"{OLLAMA_API_URL}/api/tags", timeout=5)
-                    if not health_response.ok:
-                        print("Ollama server not responding to health check")
-                        continue
-                except:
-                    print("Cannot connect to Ollama server")
-                    continue
-                    
-                payload = {
-                    "model": "phi3",
-                    "prompt": full_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "num_predict": 500
-                    }
-                }
-                
-                print(f"Sending request to: {LLM_PROVIDERS['ollama']['url']}")
-                response = requests.post(
-                    LLM_PROVIDERS["ollama"]["url"], 
-                    headers=LLM_PROVIDERS["ollama"]["headers"],
-                    json=payload, 
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                print(f"Ollama response status: {response.status_code}")
-                if response.ok:
-                    result = response.json()
-                    print(f"Ollama response keys: {result.keys()}")
-                    return result.get("response", "").strip()
-                else:
-                    print(f"Ollama error: {response.text}")
-
-            elif provider == "groq" and GROQ_API_KEY:
-                payload = {
-                    "model": "mixtral-8x7b-32768",
-                    "messages": [
-                        {"role": "system", "content": system_msg},
-                        {"role": "user", "content": f"Context: {context}\nQuestion: {prompt}"}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 500
-                }
-                
-                print("Sending request to Groq...")
-                response = requests.post(
-                    LLM_PROVIDERS["groq"]["url"],
-                    headers=LLM_PROVIDERS["groq"]["headers"],
-                    json=payload, 
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                print(f"Groq response status: {response.status_code}")
-                if response.ok:
-                    result = response.json()
-                    return result["choices"][0]["message"]["content"].strip()
-                else:
-                    print(f"Groq error: {response.text}")
-
-            elif provider == "gemini" and GEMINI_API_KEY:
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": full_prompt}]
-                    }],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "maxOutputTokens": 500
-                    }
-                }
-                
-                print("Sending request to Gemini...")
-                response = requests.post(
-                    LLM_PROVIDERS["gemini"]["url"],
-                    headers=LLM_PROVIDERS["gemini"]["headers"],
-                    json=payload, 
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                print(f"Gemini response status: {response.status_code}")
-                if response.ok:
-                    result = response.json()
-                    return result["candidates"][0]["content"]["parts"][0]["text"].strip()
-                else:
-                    print(f"Gemini error: {response.text}")
-
-            elif provider == "huggingface" and HF_TOKEN:
-                payload = {
-                    "inputs": full_prompt,
-                    "parameters": {
-                        "return_full_text": False,
-                        "max_new_tokens": 500,
-                        "temperature": 0.7,
-                        "do_sample": True
-                    },
-                    "options": {"wait_for_model": True}
-                }
-                
-                print("Sending request to HuggingFace...")
-                response = requests.post(
-                    LLM_PROVIDERS["huggingface"]["url"],
-                    headers=LLM_PROVIDERS["huggingface"]["headers"],
-                    json=payload, 
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                print(f"HuggingFace response status: {response.status_code}")
-                if response.ok:
-                    result = response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        return result[0]["generated_text"].strip()
-                else:
-                    print(f"HuggingFace error: {response.text}")
+                    f.seek(0)
+                    data = f.read()
+                    tokens, updated = struct.unpack("<dd", data) if len(data) == 16 else (self.capacity, now)
+                    tokens, wait_for = self._refill_and_take(tokens, updated, now)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(struct.pack("<dd", tokens, now))
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return wait_for
+
+    def acquire(self, deadline):
+        while True:
+            wait_for = self._take()
+            if wait_for == 0:
+                return True
+            if time.monotonic() + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+# AIMD concurrency cap - grows by one slot per window of successes, halves on overload
+class AdaptiveConcurrency:
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.active = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, deadline):
+        with self.cond:
+            while self.active >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self.active += 1
+            return True
+
+    def release(self, outcome):
+        with self.cond:
+            self.active -= 1
+            if outcome == "overload":
+                self.limit = max(self.min_limit, self.limit / 2)
+            elif outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def provider_chain(provider, report=True):
+    chain = [provider] + [p for p in LLM_FALLBACK_ORDER if p != provider and p in LLM_PROVIDERS]
+    # A selected provider without its API key is a configuration problem, not a failover
+    if report and not provider_configured(provider):
+        get_metrics().inc("llm_unconfigured_total", provider=provider)
+        log_event("llm_unconfigured", f"{provider} is selected but not configured (missing API key), skipping it",
+                  provider=provider)
+    return [p for p in chain if provider_configured(p)]
+
+# Provider client layer. The session is configured once and only read afterwards, and
+# urllib3's connection pool is thread-safe, so one client serves every Streamlit session.
+class ProviderClient:
+    def __init__(self, name, config):
+        self.name = name
+        self.url = config["url"]
+        self.stream_url = config.get("stream_url", config["url"])
+        self.health_url = config.get("health_url")
+        self.timeout = (config.get("connect_timeout", LLM_CONNECT_TIMEOUT),
+                        config.get("read_timeout", LLM_READ_TIMEOUT))
+        self.healthy_until = 0
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=100)
+        self.concurrency = AdaptiveConcurrency(config.get("max_concurrency", LLM_POOL_SIZE))
+        self.bucket = None
+        if config.get("rate_per_minute"):
+            path = None
+            if LLM_RATE_LIMIT_DIR:
+                os.makedirs(LLM_RATE_LIMIT_DIR, exist_ok=True)
+                path = os.path.join(LLM_RATE_LIMIT_DIR, f"{name}.bucket")
+            self.bucket = TokenBucket(config["rate_per_minute"], config.get("burst"), path)
+
+        self.session = requests.Session()
+        self.session.headers.update(config["headers"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.get("pool_size", LLM_POOL_SIZE))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, payload, stream=False, timeout=None):
+        return self.session.post(self.stream_url if stream else self.url, json=payload,
+                                 timeout=timeout or self.timeout, stream=stream)
+
+    def admit(self, deadline):
+        # Queue for a rate-limit token and a concurrency slot, giving up at the deadline
+        if self.bucket is not None and not self.bucket.acquire(deadline):
+            return False
+        return self.concurrency.acquire(deadline)
+
+    def finish(self, outcome):
+        # outcome: "ok", "overload" (429/timeout), "error" or "cancelled"
+        self.concurrency.release(outcome)
+        if outcome == "ok":
+            self.breaker.record_success()
+        elif outcome == "cancelled":
+            self.breaker.cancel()
+        else:
+            self.breaker.record_failure()
+
+    def timeout_until(self, deadline):
+        connect, read = self.timeout
+        return connect, max(0.1, min(read, deadline - time.monotonic()))
+
+    def hedge_delay(self):
+        if len(self.latencies) < 10:
+            return LLM_HEDGE_DELAY
+        return percentile(self.latencies, LLM_HEDGE_PERCENTILE)
+
+    def check_health(self):
+        response = self.session.get(self.health_url, timeout=self.timeout)
+        if response.ok:
+            self.healthy_until = time.time() + OLLAMA_HEALTH_TTL
+        return response
+
+    def available(self):
+        if not self.health_url or time.time() < self.healthy_until:
+            return True
+        try:
+            if self.check_health().ok:
+                return True
+            log_event("llm_health", f"{self.name} server not responding to health check", provider=self.name, reachable=False)
+        except requests.exceptions.RequestException:
+            log_event("llm_health", f"Cannot connect to {self.name} server", provider=self.name, reachable=False)
+        return False
+
+@st.cache_resource
+def get_provider_clients():
+    return {name: ProviderClient(name, config) for name, config in LLM_PROVIDERS.items()}
+
+@st.cache_resource
+def get_llm_executor():
+    return ThreadPoolExecutor(max_workers=LLM_POOL_SIZE * 2, thread_name_prefix="llm")
+
+def provider_payload(provider, prompt, system_msg, full_prompt, context, stream=False):
+    if provider == "ollama":
+        payload = {
+            "model": LLM_PROVIDERS["ollama"]["model"],
+            "prompt": full_prompt,
+            "stream": stream,
+            "options": {
+                "temperature": 0.7,
+                "num_predict": 500
+            }
+        }
+    elif provider == "groq":
+        payload = {
+            "model": LLM_PROVIDERS["groq"]["model"],
+            "messages": [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": f"Context: {context}\nQuestion: {prompt}"}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 500,
+            "stream": stream
+        }
+    elif provider == "gemini":
+        payload = {
+            "contents": [{
+                "parts": [{"text": full_prompt}]
+            }],
+            "generationConfig": {
+                "temperature": 0.7,
+                "maxOutputTokens": 500
+            }
+        }
+    else:
+        payload = {
+            "inputs": full_prompt,
+            "parameters": {
+                "return_full_text": False,
+                "max_new_tokens": 500,
+                "temperature": 0.7,
+                "do_sample": True
+            },
+            "options": {"wait_for_model": True},
+            "stream": stream
+        }
+    return payload
+
+def parse_response(provider, result):
+    if provider == "ollama":
+        return result.get("response", "").strip()
+    if provider == "groq":
+        return result["choices"][0]["message"]["content"].strip()
+    if provider == "gemini":
+        return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+    if isinstance(result, list) and len(result) > 0:
+        return result[0]["generated_text"].strip()
+    return None
+
+def iter_stream_tokens(provider, response):
+    # Ollama streams NDJSON; Groq, Gemini (alt=sse) and HuggingFace TGI stream server-sent events
+    for raw in response.iter_lines(chunk_size=None):
+        if not raw:
+            continue
+        line = raw.decode("utf-8")
+
+        if provider == "ollama":
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                return
+            continue
+
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+
+        if provider == "groq":
+            token = chunk["choices"][0]["delta"].get("content")
+        elif provider == "gemini":
+            parts = chunk.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+            token = "".join(part.get("text", "") for part in parts)
+        else:
+            token = None if chunk["token"].get("special") else chunk["token"]["text"]
+        if token:
+            yield token
+
+class ProviderError(Exception):
+    def __init__(self, provider, message, status=None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status = status
+
+# Raised when every circuit in the chain was open, so no request was sent
+class CircuitsOpen(ProviderError):
+    pass
+
+def failure_outcome(error):
+    if isinstance(error, requests.exceptions.Timeout) or getattr(error, "status", None) == 429:
+        return "overload"
+    return "error"
+
+def attempt_provider(provider, request, deadline):
+    client = get_provider_clients()[provider]
+    prompt, system_msg, full_prompt, context = request
+    if not client.admit(deadline):
+        client.breaker.cancel()
+        raise ProviderError(provider, "rate limit budget exhausted before the deadline", 429)
+
+    start = time.monotonic()
+    outcome = "cancelled"
+    try:
+        if not client.available():
+            raise ProviderError(provider, "server not reachable")
+
+        log_event("llm_request", f"Sending request to: {provider}", provider=provider)
+        response = client.post(provider_payload(provider, prompt, system_msg, full_prompt, context),
+                               timeout=client.timeout_until(deadline))
+        log_event("llm_response", f"{provider} response status: {response.status_code}",
+                  provider=provider, status=response.status_code)
+        if not response.ok:
+            raise ProviderError(provider, f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+
+        answer = parse_response(provider, response.json())
+        if answer is None:
+            raise ProviderError(provider, "empty response")
+        outcome = "ok"
+    except Exception as e:
+        outcome = failure_outcome(e)
+        if isinstance(e, ProviderError):
+            raise
+        reason = "timed out" if isinstance(e, requests.exceptions.Timeout) else f"{type(e).__name__}: {e}"
+        raise ProviderError(provider, reason) from e
+    finally:
+        client.finish(outcome)
+        record_attempt(provider, outcome, time.monotonic() - start, "request")
+
+    client.latencies.append(time.monotonic() - start)
+    return answer
+
+def record_attempt(provider, outcome, seconds, mode):
+    metrics = get_metrics()
+    metrics.inc("llm_attempts_total", provider=provider, outcome=outcome, mode=mode)
+    metrics.observe("llm_attempt_seconds", seconds, provider=provider, outcome=outcome)
+    log_event("llm_attempt", provider=provider, outcome=outcome, mode=mode, seconds=round(seconds, 3))
+
+def next_allowed(names):
+    # Pops providers off `names` until one whose circuit lets a request through
+    while names:
+        name = names.pop(0)
+        if get_provider_clients()[name].breaker.allow():
+            return name
+        get_metrics().inc("llm_skipped_total", provider=name, reason="circuit_open")
+        log_event("llm_skip", f"Skipping {name}: circuit open", provider=name, reason="circuit_open")
+    return None
+
+def hedged_attempt(chain, request, deadline):
+    # Starts with the first provider and fires the next one in the chain once the current
+    # ones are slower than their usual latency or have all failed; first answer wins
+    pool = get_llm_executor()
+    remaining = list(chain)
+    pending = {}
+    last_error = None
+    tried = False
+    hedge_at = time.monotonic()
+
+    while True:
+        now = time.monotonic()
+        if remaining and (not pending or now >= hedge_at):
+            name = next_allowed(remaining)
+            if name is not None:
+                if pending:
+                    get_metrics().inc("llm_hedges_total", provider=name)
+                    log_event("llm_hedge", f"Hedging with {name}", provider=name)
+                pending[pool.submit(attempt_provider, name, request, deadline)] = name
+                tried = True
+                hedge_at = now + get_provider_clients()[name].hedge_delay()
+        if not pending or now >= deadline:
+            break
+
+        timeout = deadline - now
+        if remaining:
+            timeout = min(timeout, max(0, hedge_at - now))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.pop(future)
+            try:
+                return future.result()
+            except ProviderError as e:
+                log_event("llm_attempt_failed", f"Hedged attempt failed - {e}", provider=e.provider, error=str(e))
+                last_error = e
+
+    if not tried:
+        raise CircuitsOpen(",".join(chain), "every circuit is open")
+    # Requests still in flight finish in the background; their answers are dropped
+    raise last_error or ProviderError(",".join(chain), "no answer before the deadline")
+
+@st.cache_resource
+def get_llm_cache():
+    return LRUCache(LLM_CACHE_SIZE, LLM_CACHE_TTL, path=LLM_CACHE_PATH, table="llm_answers")
+
+# Single-flight - identical requests that arrive while one is already running wait
+# for it and share its answer instead of going upstream themselves
+class FlightAbandoned(Exception):
+    pass
+
+class FlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self.calls[key] = FlightCall()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call.result, call.error = result, error
+        call.done.set()
 
-        except requests.exceptions.Timeout:
-            print(f"Timeout error on attempt {attempt + 1}")
-        except requests.exceptions.ConnectionError:
-            print(f"Connection error on attempt {attempt + 1}")
+    def do(self, key, fn, on_join=None):
+        call, leader = self.begin(key)
+        if not leader:
+            if on_join:
+                on_join()
+            return call.wait()
+        try:
+            result = fn()
         except Exception as e:
-            print(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-        
-        if attempt < MAX_RETRIES - 1:
-            print(f"Retrying in 2 seconds...")
-            time.sleep(2)
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.calls), "requests": self.leaders, "coalesced": self.coalesced}
+
+@st.cache_resource
+def get_llm_flight():
+    return SingleFlight()
+
+def normalize_prompt(text):
+    text = (text or "").strip()
+    if LLM_CACHE_FUZZY:
+        text = re.sub(r"\s+", " ", text).casefold().rstrip("?!. ")
+    return text
+
+# Keyed on the requested provider's whole failover chain (with models), since the answer
+# may have come from any provider in it - just as the live request's could have
+def llm_cache_key(provider, lang, claim_type, prompt, context):
+    digest = hashlib.sha256(f"{normalize_prompt(prompt)}\x00{normalize_prompt(context)}".encode("utf-8")).hexdigest()
+    chain = ">".join(f"{name}/{LLM_PROVIDERS.get(name, {}).get('model')}" for name in provider_chain(provider, report=False) or [provider])
+    return f"{chain}:{claim_type}:{lang}:{digest}"
+
+def query_llm(prompt, provider, lang="en", claim_type=None, context=None):
+    cache_key = llm_cache_key(provider, lang, claim_type, prompt, context)
+    answer = get_llm_cache().get(cache_key)
+    if answer is not None:
+        get_metrics().inc("llm_cache_hits_total", provider=provider)
+        log_event("llm_cache_hit", f"LLM cache hit for {provider}", provider=provider)
+        return answer
+
+    def fetch():
+        answer = query_providers(prompt, provider, lang, claim_type, context)
+        if answer is not None:
+            get_llm_cache().set(cache_key, answer)
+        return answer
+
+    with get_metrics().span("llm_request", provider=provider):
+        try:
+            answer = get_llm_flight().do(cache_key, fetch, on_join=lambda: record_coalesced(provider))
+        except FlightAbandoned:
+            # Joined a stream whose viewer went away before it finished
+            answer = fetch()
+    if answer is not None:
+        return answer
 
     # Return comprehensive default response if all LLMs fail
-    print(f"All LLM attempts failed, returning default response for {claim_type}")
-    default_key = claim_type if claim_type in DEFAULT_RESPONSES else "Vehicle"
-    return translator.translate(DEFAULT_RESPONSES[default_key][lang], lang)
+    record_fallback(provider, claim_type)
+    return default_response(claim_type, lang)
+
+def record_coalesced(provider):
+    get_metrics().inc("llm_coalesced_total", provider=provider)
+    log_event("llm_coalesced", f"Joining identical in-flight request to {provider}", provider=provider)
+
+def record_fallback(provider, claim_type):
+    get_metrics().inc("llm_fallbacks_total", provider=provider, claim_type=claim_type)
+    log_event("llm_fallback", f"All LLM attempts failed, returning default response for {claim_type}",
+              provider=provider, claim_type=claim_type)
+
+def record_retry(attempt, delay):
+    get_metrics().inc("llm_retries_total")
+    log_event("llm_retry", f"Retrying in {delay:.1f} seconds...", attempt=attempt + 1, delay=round(delay, 2))
+
+def query_providers(prompt, provider, lang="en", claim_type=None, context=None):
+    system_msg, full_prompt = build_prompt(prompt, lang, claim_type, context)
+    request = (prompt, system_msg, full_prompt, context)
+    deadline = time.monotonic() + LLM_DEADLINE
+    chain = provider_chain(provider)
+
+    log_event("llm_query", f"Attempting to query {' -> '.join(chain) or provider} with prompt length: {len(full_prompt)}",
+              chain=chain, prompt_chars=len(full_prompt))
+    
+    for attempt in range(MAX_RETRIES if chain else 0):
+        log_event("llm_round", f"Attempt {attempt + 1}", attempt=attempt + 1)
+        attempted = False
+        if LLM_HEDGE:
+            try:
+                return hedged_attempt(chain, request, deadline)
+            except CircuitsOpen:
+                pass
+            except ProviderError as e:
+                attempted = True
+                log_event("llm_attempt_failed", f"Attempt {attempt + 1} failed - {e}", attempt=attempt + 1, error=str(e))
+        else:
+            remaining = list(chain)
+            while time.monotonic() < deadline:
+                name = next_allowed(remaining)
+                if name is None:
+                    break
+                attempted = True
+                try:
+                    return attempt_provider(name, request, deadline)
+                except ProviderError as e:
+                    log_event("llm_attempt_failed", f"Attempt {attempt + 1} failed - {e}",
+                              attempt=attempt + 1, provider=name, error=str(e))
+
+        # Nothing was sent this round, so backing off would only delay the fallback answer
+        if not attempted:
+            break
+        delay = backoff_delay(attempt)
+        if attempt < MAX_RETRIES - 1 and time.monotonic() + delay < deadline:
+            record_retry(attempt, delay)
+            time.sleep(delay)
+    return None
+
+# Streaming variant of query_llm - yields the answer as it is generated.
+# Pass a dict as `timings` to get time-to-first-token ("ttft") and "total" seconds back.
+def stream_llm(prompt, provider, lang="en", claim_type=None, context=None, timings=None):
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+
+    cache_key = llm_cache_key(provider, lang, claim_type, prompt, context)
+    answer = get_llm_cache().get(cache_key)
+    if answer is not None:
+        get_metrics().inc("llm_cache_hits_total", provider=provider)
+        log_event("llm_cache_hit", f"LLM cache hit for {provider}", provider=provider)
+        timings["ttft"] = timings["total"] = time.perf_counter() - start
+        timings["cached"] = True
+        yield answer
+        return
+
+    flight = get_llm_flight()
+    call, leader = flight.begin(cache_key)
+    answer = None
+    if not leader:
+        record_coalesced(provider)
+        try:
+            answer = call.wait() or ""
+            timings["ttft"] = timings["total"] = time.perf_counter() - start
+            timings["coalesced"] = True
+        except FlightAbandoned:
+            log_event("llm_flight_abandoned", "In-flight request was abandoned, streaming directly", provider=provider)
+
+    if answer is None:
+        answer, complete, returned = "", False, False
+        try:
+            answer, complete = yield from stream_providers(prompt, provider, lang, claim_type, context, timings, start)
+            returned = True
+            if complete:
+                get_llm_cache().set(cache_key, answer)
+        finally:
+            # Waiters only get a complete answer. If the viewer closed the stream early or the
+            # provider broke off midway, they are released to fetch the answer themselves.
+            if leader:
+                abandoned = not returned or (answer and not complete)
+                flight.finish(cache_key, call, result=answer if complete else None,
+                              error=FlightAbandoned(cache_key) if abandoned else None)
+    elif answer:
+        yield answer
+
+    if not answer:
+        record_fallback(provider, claim_type)
+        timings["ttft"] = timings["total"] = time.perf_counter() - start
+        timings["fallback"] = True
+        yield default_response(claim_type, lang)
+
+# Providers are tried in chain order until one starts streaming; streams are never hedged.
+# Returns the streamed text and whether the stream ran to completion.
+def stream_providers(prompt, provider, lang, claim_type, context, timings, start):
+    system_msg, full_prompt = build_prompt(prompt, lang, claim_type, context)
+    deadline = time.monotonic() + LLM_DEADLINE
+    chain = provider_chain(provider)
+
+    log_event("llm_query", f"Streaming from {' -> '.join(chain) or provider} with prompt length: {len(full_prompt)}",
+              chain=chain, prompt_chars=len(full_prompt), stream=True)
+
+    for attempt in range(MAX_RETRIES if chain else 0):
+        remaining = list(chain)
+        attempted = False
+        while time.monotonic() < deadline:
+            name = next_allowed(remaining)
+            if name is None:
+                break
+            attempted = True
+            client = get_provider_clients()[name]
+            if not client.admit(deadline):
+                client.breaker.cancel()
+                get_metrics().inc("llm_skipped_total", provider=name, reason="rate_limited")
+                log_event("llm_skip", f"Skipping {name}: rate limit budget exhausted before the deadline",
+                          provider=name, reason="rate_limited")
+                continue
+            tokens = []
+            complete = False
+            outcome = "cancelled"
+            attempt_start = time.monotonic()
+            try:
+                log_event("llm_request", f"Attempt {attempt + 1} with {name}", provider=name, attempt=attempt + 1, stream=True)
+                if not client.available():
+                    raise ProviderError(name, "server not reachable")
+
+                payload = provider_payload(name, prompt, system_msg, full_prompt, context, stream=True)
+                with client.post(payload, stream=True, timeout=client.timeout_until(deadline)) as response:
+                    log_event("llm_response", f"{name} stream status: {response.status_code}",
+                              provider=name, status=response.status_code, stream=True)
+                    if not response.ok:
+                        raise ProviderError(name, f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                    for token in iter_stream_tokens(name, response):
+                        if not tokens:
+                            timings["ttft"] = time.perf_counter() - start
+                            timings["provider"] = name
+                        tokens.append(token)
+                        yield token
+                if not tokens:
+                    raise ProviderError(name, "empty response")
+                complete = True
+                outcome = "ok"
+            except Exception as e:
+                outcome = failure_outcome(e)
+                log_event("llm_attempt_failed", f"Attempt {attempt + 1} failed - {e}",
+                          attempt=attempt + 1, provider=name, error=str(e))
+            finally:
+                client.finish(outcome)
+                record_attempt(name, outcome, time.monotonic() - attempt_start, "stream")
+
+            # Tokens already reached the user, so a broken stream ends the answer instead of restarting it
+            if tokens:
+                timings["total"] = time.perf_counter() - start
+                client.latencies.append(timings["total"])
+                get_metrics().observe("llm_ttft_seconds", timings["ttft"], provider=name)
+                log_event("llm_stream_done", f"{name} stream finished: first token {timings['ttft']:.2f}s, total {timings['total']:.2f}s",
+                          provider=name, ttft=round(timings["ttft"], 3), total=round(timings["total"], 3))
+                return "".join(tokens), complete
+
+        if not attempted:
+            break
+        delay = backoff_delay(attempt)
+        if attempt < MAX_RETRIES - 1 and time.monotonic() + delay < deadline:
+            record_retry(attempt, delay)
+            time.sleep(delay)
+    return "", False
+
+# Background Jobs
+# BaseException, like asyncio.CancelledError, so the broad `except Exception` handlers in
+# the analysis code let a cancellation through
+class JobCancelled(BaseException):
+    pass
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class Job:
+    def __init__(self, kind, fn, args):
+        self.id = os.urandom(8).hex()
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.status = "queued"
+        self.progress = 0.0
+        self.preview = None
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+    
+    @property
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+    
+    # Progress callback for the job function; cancellation takes effect here
+    def report(self, done, total):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+        self.progress = min(1.0, done / total) if total else 1.0
+    
+    def show_preview(self, text):
+        self.preview = text
+    
+    def finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_RESULT_TTL):
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        for number in range(max(1, workers)):
+            threading.Thread(target=self.work, name=f"job-{number}", daemon=True).start()
+    
+    def submit(self, kind, fn, *args):
+        self.expire()
+        job = Job(kind, fn, args)
+        with self.lock:
+            self.jobs[job.id] = job
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job.id]
+            raise JobQueueFull(f"{self.queue.qsize()} jobs already waiting")
+        return job
+    
+    def get(self, job_id):
+        self.expire()
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and not job.done:
+            job.cancel_requested.set()
+            if job.status == "queued":
+                job.finish("cancelled")
+    
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job.cancel_requested.is_set():
+                continue
+            job.status = "running"
+            try:
+                job.result = job.fn(job, *job.args)
+                job.progress = 1.0
+                job.finish("done")
+            except JobCancelled:
+                job.finish("cancelled")
+            except Exception as e:
+                log_event("job_failed", f"Job {job.kind} {job.id} failed: {e}", kind=job.kind, job=job.id, error=str(e))
+                job.error = str(e)
+                job.finish("failed")
+    
+    # Finished jobs keep their results for the TTL so a later rerun can still show them
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for job_id in [i for i, job in self.jobs.items() if job.done and job.finished_at < cutoff]:
+                del self.jobs[job_id]
+    
+    def stats(self):
+        with self.lock:
+            counts = Counter(job.status for job in self.jobs.values())
+        return dict(counts, waiting=self.queue.qsize())
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+# (enhanced image, analysis) per photo, in upload order. job.partial fills in as photos
+# finish, so the page can show them while the rest are still running.
+def run_image_job(job, uploads):
+    photos = job.partial = [None] * len(uploads)
+    for done, (index, enhanced, photo_analysis) in enumerate(process_images(uploads), 1):
+        photos[index] = (enhanced, photo_analysis)
+        job.report(done, len(uploads))
+    return photos
+
+def run_report_job(job, file_bytes, scenario, lang):
+    agent = HealthAgent(lang)
+    report = agent.generate_report(file_bytes, scenario, progress=job.report, on_summary=job.show_preview)
+    return report, agent.hits
+
+def run_index_job(job, file_bytes):
+    return get_document_index(file_bytes)
+
+# The session's job for a page section and its inputs. With fn, a job for different inputs
+# (e.g. a new upload) is cancelled and replaced, and a failed or cancelled one is retried;
+# without, only a matching job is returned (whatever its status, so failures can be shown).
+def session_job(name, signature, fn=None, *args):
+    jobs = get_job_queue()
+    current = st.session_state.jobs.get(name)
+    job = jobs.get(current[0]) if current else None
+    if job and current[1] == signature and (fn is None or job.status in ("queued", "running", "done")):
+        return job
+    if fn is None:
+        return None
+    if job:
+        jobs.cancel(job.id)
+    job = jobs.submit(name, fn, *args)
+    st.session_state.jobs[name] = (job.id, signature)
+    return job
+
+# Polls a running job without rerunning the rest of the page; the whole page reruns once it finishes.
+# on_partial renders the job's partial results on every poll.
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_progress(job_id, label, lang, on_partial=None):
+    job = get_job_queue().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"{label} {job.progress:.0%}")
+    if job.preview:
+        st.caption(job.preview)
+    if st.button(translator.translate("Cancel", lang), key=f"cancel_{job_id}"):
+        get_job_queue().cancel(job_id)
+        st.rerun()
+    if on_partial and job.partial:
+        on_partial(job.partial)
+
+def render_photo(name, upload, enhanced_img, photo_analysis, lang):
+    with st.container():
+        if name:
+            st.markdown(f"**📷 {name}**")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.caption(translator.translate("Original Image", lang))
+            st.image(upload, use_container_width=True)
+        
+        with col2:
+            st.caption(translator.translate("Enhanced Image", lang))
+            st.image(enhanced_img, use_container_width=True)
+        
+        if photo_analysis.get('error'):
+            st.warning(translator.translate(f"Error processing image: {photo_analysis['error']}", lang))
+        cols = st.columns(4)
+        with cols[0]:
+            st.metric(translator.translate("Severity", lang), 
+                     translator.translate(photo_analysis['damage_level'].capitalize(), lang))
+        with cols[1]:
+            st.metric(translator.translate("Quality Score", lang), photo_analysis['quality_score'])
+        with cols[2]:
+            st.metric(translator.translate("Edge Density", lang), photo_analysis['edge_density'])
+        
+        if photo_analysis.get('heatmap'):
+            st.image(render_heatmap(enhanced_img, photo_analysis),
+                     caption=translator.translate("Damage Heatmap", lang), use_container_width=True)
+
+# Fixed UI strings - served from the compiled catalog, anything missing from it is
+# translated together in one batch per rerun
+UI_STRINGS = [
+    "Describe your situation",
+    "I had an accident and need help with my insurance claim...",
+    "Health Documents (PDF)",
+    "Damage Photos",
+    "InsuranceSaathi - Your Claim Assistant",
+    "Get instant help with your insurance claims - we're here to guide you through every step!",
+    "Original Image",
+    "Enhanced Image",
+    "Damage Analysis",
+    "Severity",
+    "Quality Score",
+    "Edge Density",
+    "Estimated Repair Cost",
+    "Overall Severity",
+    "Damage Heatmap",
+    "Issue Details",
+    "⬅️ Older messages",
+    "Newer messages ➡️",
+    "Severe",
+    "Moderate",
+    "Minor",
+    "Minimal",
+    "Unknown",
+    "Analyze Health Documents",
+    "Processing documents...",
+    "Processing photos...",
+    "Cancel",
+    "Analysis cancelled",
+    "The server is busy, please try again shortly",
+    "Document Analysis Report",
+    "Chat with InsuranceSaathi",
+    "Ask your insurance question...",
+    "Submit",
+    "Please ask insurance-related questions. I'm here to help with your insurance claims!",
+    "Generating response...",
+    "Conversation History",
+    "Quick Actions",
+    "📋 Required Documents",
+    "⏰ Claim Timeline",
+    "📞 Next Steps",
+    "🗑️ Clear Chat History"
+]
 
 # UI Configuration
 def setup_ui():
@@ -529,12 +2645,113 @@ def setup_ui():
     </style>
     """, unsafe_allow_html=True)
 
+# Per-session chat store with flat memory: the visible history is capped, and the prompt
+# gets an incrementally folded summary plus the latest turns
+class ConversationMemory:
+    def __init__(self, budget=None, keep_turns=None, history_turns=None):
+        self.budget = budget or CHAT_MEMORY_TOKENS
+        self.keep_turns = keep_turns or CHAT_KEEP_TURNS
+        self.history = deque(maxlen=history_turns or CHAT_HISTORY_TURNS)
+        self.recent = deque()
+        self.summary = deque()
+        self.count = 0
+    
+    def __len__(self):
+        return len(self.history)
+    
+    def add(self, user_msg, ai_msg):
+        self.count += 1
+        self.history.append((self.count, user_msg, ai_msg))
+        self.recent.append((user_msg, ai_msg))
+        while len(self.recent) > 1 and (len(self.recent) > self.keep_turns or self.tokens() > self.budget):
+            self.fold(*self.recent.popleft())
+    
+    # One line per folded turn: the question and the opening of the answer. The oldest
+    # lines go once the summary outgrows a third of the budget.
+    def fold(self, user_msg, ai_msg):
+        opening = re.split(r"(?<=[.!?।])\s", ai_msg.strip(), maxsplit=1)[0]
+        self.summary.append(f"asked \"{user_msg[:120]}\", told \"{opening[:160]}\"")
+        while len(self.summary) > 1 and estimate_tokens(" ".join(self.summary)) > self.budget // 3:
+            self.summary.popleft()
+    
+    def tokens(self):
+        return estimate_tokens(" ".join(self.summary)) + sum(estimate_tokens(u + a) for u, a in self.recent)
+    
+    # Prompt context, newest turns first in priority; a single long answer is clipped to fit
+    def prompt_context(self):
+        parts = []
+        if self.summary:
+            parts.append("Earlier the user " + "; then ".join(self.summary) + ".")
+        left = self.budget * 4 - sum(map(len, parts))
+        turns = []
+        for user_msg, ai_msg in reversed(self.recent):
+            turn = f"User: {user_msg}\nAssistant: {ai_msg}"[:max(left, 0)]
+            if not turn:
+                break
+            turns.insert(0, turn)
+            left -= len(turn)
+        if turns:
+            parts.append("Recent conversation:\n" + "\n".join(turns))
+        return "\n".join(parts)
+    
+    # Newest page first: page 0 holds the last CHAT_PAGE_TURNS turns
+    def page(self, number, size=None):
+        size = size or CHAT_PAGE_TURNS
+        stop = len(self.history) - number * size
+        return list(self.history)[max(0, stop - size):max(0, stop)]
+    
+    def pages(self, size=None):
+        return max(1, -(-len(self.history) // (size or CHAT_PAGE_TURNS)))
+    
+    def clear(self):
+        self.history.clear()
+        self.recent.clear()
+        self.summary.clear()
+    
+    def stats(self):
+        return {"turns": self.count, "stored": len(self.history), "verbatim": len(self.recent),
+                "summary_lines": len(self.summary), "prompt_tokens": self.tokens()}
+
+# Cache, queue and provider state exported next to the counters as Prometheus gauges
+def service_gauges():
+    gauges = {}
+    caches = {"translation": translator.cache, "image": get_image_cache(),
+              "document": get_document_cache(), "llm": get_llm_cache()}
+    for name, cache in caches.items():
+        for field, value in cache.stats().items():
+            if isinstance(value, (int, float)):
+                gauges[(f"cache_{field}", (("cache", name),))] = value
+    for status, count in get_job_queue().stats().items():
+        gauges[("jobs", (("status", status),))] = count
+    for name, client in get_provider_clients().items():
+        gauges[("llm_active_requests", (("provider", name),))] = client.concurrency.active
+        gauges[("llm_circuit_open", (("provider", name),))] = int(client.breaker.state == "open")
+    return gauges
+
+# Shows the answer as tokens arrive and returns the full text
+def stream_answer(**query):
+    st.session_state.llm_timings = {}
+    placeholder = st.empty()
+    text = ""
+    for token in stream_llm(timings=st.session_state.llm_timings, **query):
+        text += token
+        placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+    return text
+
 def main():
     setup_ui()
     
     # Initialize session state
     if "chat" not in st.session_state:
-        st.session_state.chat = []
+        st.session_state.chat = ConversationMemory()
+        st.session_state.chat_page = 0
+    if "llm_timings" not in st.session_state:
+        st.session_state.llm_timings = {}
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = {}
+    if "index_errors" not in st.session_state:
+        st.session_state.index_errors = {}
     
     # Debug panel
     with st.expander("🔧 Debug Information"):
@@ -543,11 +2760,42 @@ def main():
         st.write(f"- Gemini: {'✅ Set' if GEMINI_API_KEY else '❌ Missing'}")
         st.write(f"- Groq: {'✅ Set' if GROQ_API_KEY else '❌ Missing'}")
         st.write(f"- Ollama URL: {OLLAMA_API_URL}")
+        st.write("**Provider Circuits:** " + ", ".join(
+            f"{name}: {client.breaker.state}, {client.concurrency.active}/{int(client.concurrency.limit)} slots"
+            for name, client in get_provider_clients().items()))
+        st.write("**Translation Cache:**")
+        st.json(translator.cache.stats())
+        st.write("**Image Cache:**")
+        st.json(get_image_cache().stats())
+        st.write("**Document Cache:**")
+        st.json(get_document_cache().stats())
+        st.write("**LLM Answer Cache:**")
+        st.json(get_llm_cache().stats())
+        st.write("**Background Jobs:**")
+        st.json(get_job_queue().stats())
+        st.write("**Chat Memory:**")
+        st.json(st.session_state.chat.stats())
+        st.write("**LLM Request Coalescing:**")
+        st.json(get_llm_flight().stats())
+        st.write("**Metrics:**")
+        snapshot = get_metrics().snapshot()
+        st.json(snapshot, expanded=False)
+        col1, col2 = st.columns(2)
+        col1.download_button("Prometheus metrics", get_metrics().prometheus(gauges=service_gauges()),
+                             file_name="metrics.prom", mime="text/plain")
+        col2.download_button("Metrics JSON", json.dumps(snapshot, indent=2),
+                             file_name="metrics.json", mime="application/json")
+        if st.session_state.llm_timings:
+            timings = st.session_state.llm_timings
+            st.write(f"**Last LLM response:** first token {timings.get('ttft', 0):.2f}s, "
+                     f"total {timings.get('total', 0):.2f}s"
+                     f"{' (default response)' if timings.get('fallback') else ''}{' (cached)' if timings.get('cached') else ''}"
+                     f"{' (shared with an identical request)' if timings.get('coalesced') else ''}")
         
         # Test Ollama connection
         if st.button("Test Ollama Connection"):
             try:
-                response = requests.get(f"{OLLAMA_API_URL}/api/tags", timeout=5)
+                response = get_provider_clients()["ollama"].check_health()
                 if response.ok:
                     models = response.json().get('models', [])
                     st.success(f"✅ Ollama connected! Available models: {[m['name'] for m in models]}")
@@ -559,8 +2807,10 @@ def main():
     # Sidebar - Configuration
     with st.sidebar:
         st.title("⚙️ Configuration")
-        lang = st.selectbox("Language", ["en", "hi"], 
+        lang = st.selectbox("Language", LANGUAGES, 
                           format_func=lambda x: "English" if x == "en" else "हिंदी")
+        # Strings missing from the catalog are fetched here in one batch so the translate() calls below hit the cache
+        translator.translate_many(UI_STRINGS, lang)
         provider = st.selectbox("AI Provider", ["ollama", "groq", "gemini", "huggingface"])
         claim_type = st.selectbox("Claim Type", ["Vehicle", "Health", "Home"])
         
@@ -574,8 +2824,8 @@ def main():
         st.subheader("📁 Upload Files")
         pdf_file = st.file_uploader(translator.translate("Health Documents (PDF)", lang), 
                                   type=["pdf"])
-        image_file = st.file_uploader(translator.translate("Damage Photos", lang), 
-                                    type=["jpg", "png", "jpeg"])
+        image_files = st.file_uploader(translator.translate("Damage Photos", lang), 
+                                     type=["jpg", "png", "jpeg"], accept_multiple_files=True)
     
     # Main Content
     st.title(f"🛡️ {translator.translate('InsuranceSaathi - Your Claim Assistant', lang)}")
@@ -583,51 +2833,101 @@ def main():
     
     # Show quick help based on claim type
     with st.expander(f"📖 Quick Guide for {claim_type} Claims"):
-        default_response = DEFAULT_RESPONSES.get(claim_type, DEFAULT_RESPONSES["Vehicle"])
-        st.markdown(translator.translate(default_response[lang], lang))
+        st.markdown(default_response(claim_type, lang))
     
     # Image Processing Section
-    if image_file:
+    analysis = None
+    if image_files:
         try:
-            col1, col2 = st.columns(2)
-            with col1:
-                st.subheader(translator.translate("Original Image", lang))
-                original_img = Image.open(image_file)
-                st.image(original_img, use_container_width=True)
-            
-            with col2:
-                st.subheader(translator.translate("Enhanced Image", lang))
-                enhanced_img = enhance_image(original_img)
-                st.image(enhanced_img, use_container_width=True)
-            
-            analysis = analyze_image(enhanced_img)
-            
             st.subheader(translator.translate("Damage Analysis", lang))
-            cols = st.columns(4)
-            with cols[0]:
-                st.metric(translator.translate("Severity", lang), 
-                         translator.translate(analysis['damage_level'].capitalize(), lang))
-            with cols[1]:
-                st.metric(translator.translate("Quality Score", lang), analysis['quality_score'])
-            with cols[2]:
-                st.metric(translator.translate("Edge Density", lang), analysis['edge_density'])
-            
-            cost_range = estimate_repair_cost(scenario, analysis, claim_type)
-            st.success(f"💵 {translator.translate('Estimated Repair Cost', lang)}: ₹{cost_range[0]:,} - ₹{cost_range[1]:,}")
+            uploads = [f.getvalue() for f in image_files]
+            names = [f.name if len(uploads) > 1 else None for f in image_files]
+            signature = tuple(image_cache_key(data) for data in uploads)
+            cache = get_image_cache()
+            # Photos not processed yet go to a background job; each one is shown as soon as it is done
+            job = session_job("images", signature)
+            if job is None and not all(cache.get(key) is not None for key in signature):
+                job = session_job("images", signature, run_image_job, uploads)
+            if job and job.status in ("queued", "running"):
+                def show_finished(partial):
+                    for index, photo in enumerate(partial):
+                        if photo is not None:
+                            render_photo(names[index], uploads[index], *photo, lang)
+                job_progress(job.id, translator.translate("Processing photos...", lang), lang, on_partial=show_finished)
+            elif job and job.status in ("failed", "cancelled"):
+                if job.status == "failed":
+                    st.error(translator.translate(f"Error processing image: {job.error}", lang))
+                else:
+                    st.info(translator.translate("Analysis cancelled", lang))
+                if st.button(translator.translate("Retry", lang), key="retry_images"):
+                    session_job("images", signature, run_image_job, uploads)
+                    st.rerun()
+            else:
+                # Every photo is cached when no job was needed
+                photos = job.result if job else [None] * len(uploads)
+                if job is None:
+                    for index, enhanced_img, photo_analysis in process_images(uploads):
+                        photos[index] = (enhanced_img, photo_analysis)
+                analyses = []
+                for index, (enhanced_img, photo_analysis) in enumerate(photos):
+                    analyses.append(photo_analysis)
+                    render_photo(names[index], uploads[index], enhanced_img, photo_analysis, lang)
+                
+                analysis = combine_analyses(analyses)
+                if len(analyses) > 1:
+                    st.metric(translator.translate("Overall Severity", lang),
+                              translator.translate(analysis['damage_level'].capitalize(), lang))
+                
+                cost_range = estimate_repair_cost(scenario, analysis, claim_type)
+                st.success(f"💵 {translator.translate('Estimated Repair Cost', lang)}: ₹{cost_range[0]:,} - ₹{cost_range[1]:,}")
             
+        except JobQueueFull:
+            st.warning(translator.translate("The server is busy, please try again shortly", lang))
         except Exception as e:
             st.error(translator.translate(f"Error processing image: {e}", lang))
     
     # PDF Processing Section
-    if pdf_file and st.button(translator.translate("Analyze Health Documents", lang)):
-        with st.spinner(translator.translate("Processing documents...", lang)):
+    pdf_job = None
+    if pdf_file:
+        data = pdf_file.getvalue()
+        # The chat's document search index is built in the background as soon as a PDF is uploaded.
+        # A file whose index failed is remembered by its hash and only retried once a different
+        # file has been uploaded in between.
+        doc_key = document_cache_key(data)
+        index_errors = st.session_state.index_errors
+        index_job = session_job("index", doc_key)
+        if index_job and index_job.status == "failed" and doc_key not in index_errors:
+            index_errors.clear()
+            index_errors[doc_key] = index_job.error
+            log_event("retrieval_failed", f"Document retrieval failed: {index_job.error}", error=index_job.error)
+            st.warning(translator.translate(f"Document search is not available for this file: {index_job.error}", lang))
+        elif doc_key not in index_errors and (index_job is None or index_job.status == "cancelled"):
+            index_errors.clear()
             try:
-                agent = HealthAgent(lang)
-                report = agent.generate_report(pdf_file.read(), scenario)
-                st.subheader(translator.translate("Document Analysis Report", lang))
-                st.text_area(label="", value=report, height=200)
-            except Exception as e:
-                st.error(translator.translate(f"Error processing PDF: {e}", lang))
+                session_job("index", doc_key, run_index_job, data)
+            except JobQueueFull:
+                pass
+        signature = (hashlib.sha256(data).hexdigest(), scenario, lang)
+        pdf_job = session_job("pdf", signature)
+        if st.button(translator.translate("Analyze Health Documents", lang)):
+            try:
+                pdf_job = session_job("pdf", signature, run_report_job, data, scenario, lang)
+            except JobQueueFull:
+                st.warning(translator.translate("The server is busy, please try again shortly", lang))
+    
+    if pdf_job and pdf_job.status in ("queued", "running"):
+        job_progress(pdf_job.id, translator.translate("Processing documents...", lang), lang)
+    elif pdf_job and pdf_job.status == "done":
+        report, hits = pdf_job.result
+        st.subheader(translator.translate("Document Analysis Report", lang))
+        st.text_area(label="", value=report, height=200)
+        if hits:
+            with st.expander(translator.translate("Issue Details", lang)):
+                st.dataframe(hits, use_container_width=True)
+    elif pdf_job and pdf_job.status == "failed":
+        st.error(translator.translate(f"Error processing PDF: {pdf_job.error}", lang))
+    elif pdf_job and pdf_job.status == "cancelled":
+        st.info(translator.translate("Analysis cancelled", lang))
     
     # Chat Interface
     st.markdown("---")
@@ -644,10 +2944,23 @@ def main():
         else:
             with st.spinner(translator.translate("Generating response...", lang)):
                 context = f"{claim_type} claim scenario: {scenario}"
-                if image_file:
+                if analysis:
                     context += f". Image analysis shows {analysis['damage_level']} damage level."
+                doc_key = document_cache_key(pdf_file.getvalue()) if pdf_file else None
+                index_job = session_job("index", doc_key) if pdf_file else None
+                if index_job and index_job.status == "done":
+                    excerpts = document_context(index_job.result, user_input, pdf_file.name)
+                    if excerpts:
+                        context += f"\nExcerpts from the uploaded documents (cite them as [file p.N]):\n{excerpts}"
+                elif doc_key in st.session_state.index_errors or (index_job and index_job.status == "failed"):
+                    pass  # already reported when the index failed; answer without excerpts
+                elif pdf_file:
+                    st.toast(translator.translate("Document search is still being prepared, answering without it", lang))
+                history = st.session_state.chat.prompt_context()
+                if history:
+                    context += f"\n{history}"
                 
-                response = query_llm(
+                response = stream_answer(
                     prompt=user_input,
                     provider=provider,
                     lang=lang,
@@ -655,13 +2968,25 @@ def main():
                     context=context
                 )
                 
-                st.session_state.chat.append((user_input, response))
+                st.session_state.chat.add(user_input, response)
+                st.session_state.chat_page = 0
                 st.rerun()
     
     # Display Chat History
     if st.session_state.chat:
         st.subheader(translator.translate("Conversation History", lang))
-        for i, (user_msg, ai_msg) in enumerate(st.session_state.chat):
+        chat = st.session_state.chat
+        page = min(st.session_state.chat_page, chat.pages() - 1)
+        if chat.pages() > 1:
+            older, position, newer = st.columns([1, 2, 1])
+            if older.button(translator.translate("⬅️ Older messages", lang), disabled=page >= chat.pages() - 1):
+                st.session_state.chat_page = page + 1
+                st.rerun()
+            position.caption(f"{page + 1} / {chat.pages()}")
+            if newer.button(translator.translate("Newer messages ➡️", lang), disabled=page == 0):
+                st.session_state.chat_page = page - 1
+                st.rerun()
+        for i, user_msg, ai_msg in chat.page(page):
             message(user_msg, is_user=True, key=f"user_{i}")
             message(ai_msg, key=f"ai_{i}")
     
@@ -674,45 +2999,49 @@ def main():
     with col1:
         if st.button(translator.translate("📋 Required Documents", lang)):
             context = f"User needs to know required documents for {claim_type} claim"
-            response = query_llm(
+            response = stream_answer(
                 prompt=f"What documents are required for {claim_type} insurance claim?",
                 provider=provider,
                 lang=lang,
                 claim_type=claim_type,
                 context=context
             )
-            st.session_state.chat.append((f"What documents do I need for {claim_type} claim?", response))
+            st.session_state.chat.add(f"What documents do I need for {claim_type} claim?", response)
+            st.session_state.chat_page = 0
             st.rerun()
     
     with col2:
         if st.button(translator.translate("⏰ Claim Timeline", lang)):
             context = f"User wants to know the timeline for {claim_type} claim processing"
-            response = query_llm(
+            response = stream_answer(
                 prompt=f"What is the typical timeline for {claim_type} insurance claim processing?",
                 provider=provider,
                 lang=lang,
                 claim_type=claim_type,
                 context=context
             )
-            st.session_state.chat.append((f"How long does {claim_type} claim take?", response))
+            st.session_state.chat.add(f"How long does {claim_type} claim take?", response)
+            st.session_state.chat_page = 0
             st.rerun()
     
     with col3:
         if st.button(translator.translate("📞 Next Steps", lang)):
             context = f"User wants to know next steps for {claim_type} claim with scenario: {scenario}"
-            response = query_llm(
+            response = stream_answer(
                 prompt=f"What should I do next for my {claim_type} insurance claim?",
                 provider=provider,
                 lang=lang,
                 claim_type=claim_type,
                 context=context
             )
-            st.session_state.chat.append(("What are my next steps?", response))
+            st.session_state.chat.add("What are my next steps?", response)
+            st.session_state.chat_page = 0
             st.rerun()
     
     # Clear chat button
     if st.session_state.chat and st.button(translator.translate("🗑️ Clear Chat History", lang)):
-        st.session_state.chat = []
+        st.session_state.chat.clear()
+        st.session_state.chat_page = 0
         st.rerun()
 
 if __name__ == "__main__":
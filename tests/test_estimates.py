@@ -0,0 +1,42 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import insurance_claim_assistant as app
+
+WORDS = ["İstanbul", "ẞtraße", "Ǆemal", "ﬁre", "bumper", "कार", "flood", "roof", "Σ", "leak"]
+
+def random_claims(n, seed=0):
+    rng = random.Random(seed)
+    tariff = app.get_tariff()
+    severities = list(tariff.severities)
+    claims = []
+    for _ in range(n):
+        words = rng.choices(WORDS, k=rng.randint(0, 4)) + rng.choices(severities, k=rng.randint(0, 1))
+        rng.shuffle(words)
+        desc = " ".join(word.upper() if rng.random() < 0.3 else word for word in words)
+        claims.append((desc, {"damage_level": rng.choice(severities + ["unknown"]),
+                              "cost_multiplier": rng.choice([0.5, 1.0, 1.25, 2.0])},
+                       rng.choice(list(tariff.claim_types) + ["Travel"])))
+    return claims
+
+def estimate_batch(claims):
+    descs, analyses, types = zip(*claims)
+    severities = app.claim_severities(descs, [a["damage_level"] for a in analyses])
+    return app.get_tariff().estimate_batch(types, severities, [a["cost_multiplier"] for a in analyses])
+
+def test_batch_matches_scalar_estimates():
+    claims = random_claims(5000)
+    expected = np.array([app.estimate_repair_cost(*claim) for claim in claims])
+    assert (estimate_batch(claims) == expected).all()
+    # Small batches, where the longest description sets the array's string width
+    for start in range(0, len(claims), 4):
+        assert (estimate_batch(claims[start:start + 4]) == expected[start:start + 4]).all()
+
+def test_lengthening_lowercase_keeps_the_severity():
+    tariff = app.get_tariff()
+    severity = tariff.severities[-1]
+    assert app.claim_severities([f"İstanbul {severity}"], ["unknown"])[0] == severity